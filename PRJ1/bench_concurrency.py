@@ -0,0 +1,103 @@
+import run
+import multiprocessing, os, shutil, subprocess, sys, tempfile, time
+
+# read queries of every access path (primary key seek, index range scan, full scan with aggregate)
+QUERIES = [
+    "select * from items where id = 1234;",
+    "select name, price from items where price >= 990 order by price;",
+    "select count(*), max(price) from items where name = 'item7';",
+]
+
+def setup(directory, rows):
+    """Create the test database by running run.py on a script (LOAD DATA of a generated csv file)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    shutil.copy(os.path.join(here, 'grammar.lark'), directory)
+    with open(os.path.join(directory, 'items.csv'), 'w') as file:
+        for i in range(rows):
+            file.write(f"{i},item{i % 100},{i % 1000}\n")
+    script = ("create table items (id int, name char(20), price int, primary key (id));\n"
+              "load data 'items.csv' into table items;\n"
+              "create index items_price on items (price);\n"
+              "exit;\n")
+    subprocess.run([sys.executable, os.path.join(here, 'run.py')], input=script, text=True,
+                   cwd=directory, stdout=subprocess.DEVNULL, check=True)
+
+def session(directory):
+    """Open the shared database like a run.py process, returns the transformer and the parser."""
+    os.chdir(directory)
+    # the results of the queries are not needed
+    sys.stdout = open(os.devnull, 'w')
+    with open('grammar.lark') as file:
+        parser = run.build_parser(file.read())
+    transformer = run.MyTransformer()
+    run.open_database("myDB.db")
+    run.start_session(transformer)
+    return transformer, parser
+
+def reader(directory, seconds, results):
+    """Run the read queries for the given time, each round is one group like an interactive session."""
+    transformer, parser = session(directory)
+    trees = [parser.parse(query) for query in QUERIES]
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for tree in trees:
+            run.run_statement(transformer, lambda: transformer.transform(tree))
+            count += 1
+        run.myTransactions.commit_group()
+    run.close_database()
+    results.put(count)
+
+def writer(directory, seconds, first_id, results):
+    """Insert rows (one commit each) while the readers run."""
+    transformer, parser = session(directory)
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        tree = parser.parse(f"insert into items values ({first_id + count}, 'new', {count % 1000});")
+        run.run_statement(transformer, lambda: transformer.transform(tree))
+        run.myTransactions.commit_group()
+        count += 1
+    run.close_database()
+    results.put(count)
+
+def measure(directory, readers, writers, seconds):
+    """queries/sec of the readers and inserts/sec of the writers running at the same time"""
+    reads, writes = multiprocessing.Queue(), multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=reader, args=(directory, seconds, reads)) for _ in range(readers)]
+    processes += [multiprocessing.Process(target=writer, args=(directory, seconds, 10 ** 9 * (i + 1), writes)) for i in range(writers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    if any(process.exitcode != 0 for process in processes):
+        raise RuntimeError("a stress test process has failed")
+    read_count = sum(reads.get() for _ in range(readers))
+    write_count = sum(writes.get() for _ in range(writers))
+    return read_count / seconds, write_count / seconds
+
+def main() -> None:
+    max_readers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    writers = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    rows = int(sys.argv[4]) if len(sys.argv) > 4 else 20000
+
+    directory = tempfile.mkdtemp()
+    try:
+        setup(directory, rows)
+        print('-' * 64)
+        print("{:<12}| {:>15}| {:>15}| {:>15}".format("readers", "queries/sec", "speedup", "inserts/sec"))
+        base = None
+        readers = 1
+        while readers <= max_readers:
+            read_rate, write_rate = measure(directory, readers, writers, seconds)
+            base = base or read_rate
+            print("{:<12}| {:>15.0f}| {:>15.2f}| {:>15.0f}".format(readers, read_rate, read_rate / base, write_rate))
+            readers *= 2
+        print('-' * 64)
+        print(f"{os.cpu_count()} cpus, {writers} writer process(es), {rows} rows")
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
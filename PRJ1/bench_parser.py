@@ -0,0 +1,94 @@
+from lark import Lark, UnexpectedInput
+import os, sys, time, tempfile
+
+# statements covering every query type of grammar.lark
+STATEMENTS = [
+    "create table students (id char(10) not null, name char(20), primary key (id));",
+    "create table ref (id int not null, stu_id char(10), reg date, primary key (id), foreign key (stu_id) references students (id));",
+    "create index ref_reg on ref (reg);",
+    "drop index ref_reg;",
+    "drop table ref;",
+    "explain students;",
+    "describe students;",
+    "desc students;",
+    "show tables;",
+    "insert into students values ('s1', 'kim');",
+    "insert into ref (id, stu_id, reg) values (1, 's1', 2024-03-01);",
+    "delete from ref where reg < 2024-01-01 and stu_id = 's1';",
+    "update ref set reg = 2024-01-01 where id = 3;",
+    "select * from students;",
+    "select s.name, count(*) from students as s, ref as r where s.id = r.stu_id or not (r.reg is null);",
+    "select students.name, ref.reg from students join ref on students.id = ref.stu_id where ref.id >= 3 order by ref.reg desc, students.name;",
+    "select max(reg) as last, min(reg) from ref;",
+    "select name from students order by name limit 10 offset 20;",
+    "insert into students values ('s2', 'lee'), ('s3', null), ('s4', 'park');",
+    "load data 'students.csv' into table students;",
+    "begin;",
+    "commit;",
+    "rollback;",
+    "analyze ref;",
+    "explain select * from ref where id = 3;",
+    "explain analyze select count(*) from ref where reg > 2024-01-01;",
+    "create table logs (id int, msg char(100)) using columnar;",
+    "set output csv;",
+    "create table data (load int, index char(4));",
+]
+
+def build(grammar, **options):
+    """Build a parser with the start rule of run.py and the given options
+    (run.py: lalr with the contextual lexer, before the switch: earley with the basic lexer)"""
+    return Lark(grammar, start="command", **options)
+
+def parses(parser, statement):
+    try:
+        parser.parse(statement)
+        return True
+    except UnexpectedInput:
+        return False
+
+def time_build(grammar, **options):
+    start = time.perf_counter()
+    parser = build(grammar, **options)
+    return parser, time.perf_counter() - start
+
+def statements_per_second(parser, statements, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for statement in statements:
+            parser.parse(statement)
+    return rounds * len(statements) / (time.perf_counter() - start)
+
+def main() -> None:
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grammar.lark')) as file:
+        grammar = file.read()
+
+    cache_file = os.path.join(tempfile.mkdtemp(), 'grammar.cache')
+    earley, earley_build = time_build(grammar, lexer="basic")
+    lalr, lalr_build = time_build(grammar, parser="lalr", lexer="contextual")
+    _, cold_cache_build = time_build(grammar, parser="lalr", lexer="contextual", cache=cache_file)
+    _, warm_cache_build = time_build(grammar, parser="lalr", lexer="contextual", cache=cache_file)
+
+    # the basic lexer always reads a keyword as a keyword, a statement using one as a name only parses with lalr.
+    # both parsers are timed on the statements the earley baseline parses
+    for statement in STATEMENTS:
+        lalr.parse(statement)
+    statements = [statement for statement in STATEMENTS if parses(earley, statement)]
+    # both parsers must produce the same trees, the transformer depends on them
+    for statement in statements:
+        assert earley.parse(statement) == lalr.parse(statement), statement
+
+    print('-' * 48)
+    print("{:<28}| {:>17}".format("startup", "seconds"))
+    print("{:<28}| {:>17.4f}".format("earley", earley_build))
+    print("{:<28}| {:>17.4f}".format("lalr", lalr_build))
+    print("{:<28}| {:>17.4f}".format("lalr (writing cache)", cold_cache_build))
+    print("{:<28}| {:>17.4f}".format("lalr (from cache)", warm_cache_build))
+    print('-' * 48)
+    print("{:<28}| {:>17}".format(f"parse ({len(statements)}/{len(STATEMENTS)} stmts)", "statements/sec"))
+    print("{:<28}| {:>17.0f}".format("earley", statements_per_second(earley, statements, rounds)))
+    print("{:<28}| {:>17.0f}".format("lalr", statements_per_second(lalr, statements, rounds)))
+    print('-' * 48)
+
+if __name__ == '__main__':
+    main()
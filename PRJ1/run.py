@@ -1,10 +1,205 @@
 from lark import Lark, Transformer, Tree, Token
 from berkeleydb import db
-import json, os
-from datetime import datetime
+from datetime import date
+import json, os, sys, operator, struct, csv, heapq, itertools, pickle, tempfile, time, bisect, hashlib, math, re
+from array import array
+from abc import ABC, abstractmethod
+
+class TransactionalDB():
+    """Handle of myDB.db, every read and write runs in the current transaction of the session (myTransactions)."""
+    def __init__(self):
+        self.handle = None
+
+    def open(self, path, dbtype, flags=0):
+        self.handle = db.DB(myEnv)
+        self.handle.open(path, dbtype=dbtype, flags=flags | db.DB_AUTO_COMMIT)
+
+    def get(self, key, flags=0):
+        # flags=db.DB_RMW takes the write lock at once for a read-modify-write (no deadlock between two writers)
+        return self.handle.get(key, txn=myTransactions.current, flags=flags)
+
+    def put(self, key, value):
+        self.handle.put(key, value, txn=myTransactions.current)
+
+    def delete(self, key):
+        self.handle.delete(key, txn=myTransactions.current)
+
+    def cursor(self, handle=None):
+        """cursor on myDB (or on the handle of an index)"""
+        return myTransactions.cursor(handle or self.handle)
+
+    def associate(self, secondary, callback, flags=0):
+        self.handle.associate(secondary, callback, flags=flags, txn=myTransactions.current)
+
+    def close(self):
+        self.handle.close()
+
+class Transactions():
+    """Transactions of the session.
+    statements outside BEGIN ... COMMIT share one transaction (group commit): an interactive session commits it
+    before waiting for the next input, a script every GROUP_COMMIT_STATEMENTS statements and at the end.
+    BEGIN starts a user transaction that lasts until COMMIT / ROLLBACK.
+    every statement runs in a transaction nested in it, so a failed statement is undone alone"""
+    def __init__(self):
+        self.outer = None # transaction of the group or the user transaction
+        self.user = False # outer was started by BEGIN
+        self.current = None # innermost transaction, used by every read/write
+        self.statements = 0 # statements in outer
+        self.cursors = set() # open cursors of the current transaction
+
+    def cursor(self, handle):
+        cursor = handle.cursor(self.current)
+        self.cursors.add(cursor)
+        return cursor
+
+    def close_cursor(self, cursor):
+        """close a cursor of myTransactions.cursor, the cursors of a statement do not pile up until it ends.
+        a cursor already closed with its transaction (a scan generator finished later) is left alone"""
+        if cursor in self.cursors:
+            self.cursors.remove(cursor)
+            cursor.close()
+
+    def _close_cursors(self):
+        # a transaction cannot end with open cursors (e.g. a scan stopped by LIMIT)
+        for cursor in self.cursors:
+            cursor.close()
+        self.cursors = set()
+
+    def retry_after_deadlock(self):
+        """Roll back the statement that lost a deadlock, returns True if it can be run again.
+        outside a user transaction the group is committed first to release its locks,
+        a user transaction cannot continue and is rolled back"""
+        self.end_statement(False)
+        if self.user:
+            self.outer.abort()
+            self.outer = self.current = None
+            self.user = False
+            self.statements = 0
+            return False
+        self.commit_group()
+        return True
+
+    def _commit_outer(self):
+        self.outer.commit(COMMIT_FLAGS[COMMIT_SYNC])
+        self.outer = self.current = None
+        self.user = False
+        self.statements = 0
+
+    def begin_statement(self):
+        if self.outer is None:
+            self.outer = self.current = myEnv.txn_begin()
+        self.current = myEnv.txn_begin(self.outer)
+
+    def end_statement(self, success):
+        self._close_cursors()
+        if success:
+            self.current.commit()
+        else:
+            self.current.abort()
+        self.current = self.outer
+        self.statements += 1
+
+    def commit_group(self):
+        """commit the statements run outside a user transaction"""
+        if self.outer is not None and not self.user:
+            self._close_cursors()
+            self._commit_outer()
+
+    def begin(self):
+        """BEGIN: the statements before it are committed, the following ones run in a user transaction"""
+        if self.user:
+            Messages.TransactionInProgress()
+            raise QueryError
+        self._close_cursors()
+        self.current.commit()
+        self._commit_outer()
+        self.outer = myEnv.txn_begin()
+        self.user = True
+        self.current = myEnv.txn_begin(self.outer)
+
+    def end(self, commit):
+        """COMMIT / ROLLBACK of the user transaction, the rest of the input runs in a new group"""
+        if not self.user:
+            Messages.NoTransaction("Commit" if commit else "Rollback")
+            raise QueryError
+        self._close_cursors()
+        if commit:
+            self.current.commit()
+            self._commit_outer()
+        else:
+            self.current.abort()
+            self.outer.abort()
+            self.outer = self.current = None
+            self.user = False
+            self.statements = 0
+        self.begin_statement()
+
+    def close(self):
+        """commit the group, an unfinished user transaction is rolled back"""
+        self._close_cursors()
+        if self.outer is None:
+            return
+        if self.current is not self.outer:
+            self.current.commit()
+        if self.user:
+            self.outer.abort()
+            self.outer = self.current = None
+            self.user = False
+        else:
+            self._commit_outer()
 
+# environment of the database files (transactions, write-ahead log, locks, shared memory pool), opened in open_database
+myEnv = db.DBEnv()
 # Create a database object
-myDB = db.DB()
+myDB = TransactionalDB()
+myTransactions = Transactions()
+# secondary (btree) databases of the indexes, index_name -> db object associated with myDB
+myIndexes = {}
+# secondary databases of the foreign keys, (table_name, referenced table_name) -> db object associated with myDB
+myReferenceIndexes = {}
+
+# version of the on-disk layout (see migrate_database)
+# 0: one json list per table under data:<table_name>, hash database
+# 1: one json object per row under row:<table_name>:<rowid>, btree database
+# 2: rows of a table with a primary key are stored under row:<table_name>:<encoded primary key>
+# 3: reverse foreign key mapping referenced_by:<referenced table_name>:<table_name>
+# 4: date values are stored as ordinals (date.toordinal) instead of YYYY-MM-DD strings
+# 5: rows are stored in the binary format of RowCodec instead of json objects
+# 6: table statistics under stats:<table_name>
+# 7: primary key entries colkey:<table_name>:<encoded primary key> of the columnar tables
+FORMAT_VERSION = 7
+
+# number of values in one segment of a column of a columnar table
+COLUMNAR_SEGMENT_ROWS = 4096
+
+# table statistics: 2^HLL_PRECISION registers of the HyperLogLog of each column (about 3% error with 10),
+# buckets of the equi-depth histogram of int/date columns, selectivity of a condition the statistics cannot estimate
+HLL_PRECISION = 10
+HISTOGRAM_BUCKETS = 32
+DEFAULT_SELECTIVITY = 1 / 3
+# the histogram is ignored (min/max are used) once more than this fraction of the rows changed since the last ANALYZE
+STALE_HISTOGRAM_FRACTION = 0.2
+# a secondary index is used only for conditions estimated to select at most this fraction of the rows
+INDEX_SCAN_SELECTIVITY = 0.3
+# join orders of up to this many tables are chosen by dynamic programming over the subsets, larger ones greedily
+DP_JOIN_TABLES = 8
+
+# durability of a commit: "sync" (the log is flushed to disk), "write_nosync" (written to the OS, lost on a system crash)
+# or "nosync" (kept in the log buffer, lost on a process crash)
+COMMIT_SYNC = "sync"
+COMMIT_FLAGS = {"sync": db.DB_TXN_SYNC, "write_nosync": db.DB_TXN_WRITE_NOSYNC, "nosync": db.DB_TXN_NOSYNC}
+# statements of a script committed together (one log flush), their locks are held until the commit
+GROUP_COMMIT_STATEMENTS = 1000
+# a statement that loses a deadlock against another process is rolled back and run again up to this many times
+DEADLOCK_RETRIES = 5
+
+# memory budget of ORDER BY (number of rows), larger results are sorted in runs spilled to temporary files and merged
+SORT_MEMORY_ROWS = 100000
+
+# rows of a query result formatted before they are written to stdout at once
+RESULT_BUFFER_ROWS = 1000
+# LOAD DATA reads the file one row at a time and writes the validated rows this many at a time
+LOAD_BATCH_ROWS = 1000
 
 class Messages():
     """Class that contains the messages to be printed to the user."""
@@ -17,6 +212,30 @@ class Messages():
     def SyntaxError():
         print(Messages.prompt + "Syntax error")
     @staticmethod
+    def TransactionBegin():
+        print(Messages.prompt + "Transaction started")
+    @staticmethod
+    def TransactionCommit():
+        print(Messages.prompt + "Transaction committed")
+    @staticmethod
+    def TransactionRollback():
+        print(Messages.prompt + "Transaction rolled back")
+    @staticmethod
+    def TransactionInProgress():
+        print(Messages.prompt + "Begin has failed: transaction already in progress")
+    @staticmethod
+    def DeadlockError():
+        print(Messages.prompt + "Deadlock detected, the transaction has been rolled back")
+    @staticmethod
+    def UpgradeDuplicatePrimaryKeyError(tableName, rowText):
+        print(f"{Messages.prompt}Upgrade has failed: {rowText} is duplicated in '{tableName}'")
+    @staticmethod
+    def UpgradeInvalidDateError(tableName, rowText, colName, value):
+        print(f"{Messages.prompt}Upgrade has failed: {rowText} of '{tableName}' has an invalid date {value} in column '{colName}'")
+    @staticmethod
+    def NoTransaction(commandName):
+        print(Messages.prompt + f"{commandName} has failed: no transaction in progress")
+    @staticmethod
     def CreateTableSuccess(tablename):
         print(f"{Messages.prompt}'{tablename}' table is created")
     @staticmethod
@@ -47,6 +266,36 @@ class Messages():
     def CharLengthError():
         print(Messages.prompt + "Char length should be over 0")
     @staticmethod
+    def LimitValueError():
+        print(Messages.prompt + "LIMIT and OFFSET should not be negative")
+    @staticmethod
+    def ReferenceColumnarTableError():
+        print(Messages.prompt + "Create table has failed: foreign key cannot be used with a columnar table")
+    @staticmethod
+    def AnalyzeSuccess(tableName):
+        print(Messages.prompt + f"'{tableName}' table is analyzed")
+    @staticmethod
+    def OutputFormatSet(outputFormat):
+        print(Messages.prompt + f"Query results are written as {outputFormat}")
+    @staticmethod
+    def CreateIndexSuccess(indexName):
+        print(f"{Messages.prompt}'{indexName}' index is created")
+    @staticmethod
+    def IndexExistenceError():
+        print(Messages.prompt + "Create index has failed: index with the same name already exists")
+    @staticmethod
+    def IndexColumnExistenceError(colName):
+        print(Messages.prompt + f"Create index has failed: '{colName}' does not exist")
+    @staticmethod
+    def IndexColumnarTableError():
+        print(Messages.prompt + "Create index has failed: columnar tables cannot be indexed")
+    @staticmethod
+    def DropIndexSuccess(indexName):
+        print(f"{Messages.prompt}'{indexName}' index is dropped")
+    @staticmethod
+    def NoSuchIndex():
+        print(Messages.prompt + "Drop index has failed: no such index")
+    @staticmethod
     def DropSuccess(tableName):
         print(f"{Messages.prompt}'{tableName}' table is dropped")
     @staticmethod
@@ -56,8 +305,17 @@ class Messages():
     def DropReferencedTableError(tableName):
         print(Messages.prompt + f"Drop table has failed: '{tableName}' is referenced by another table")
     @staticmethod
-    def InsertResult():
-        print(Messages.prompt + "1 row inserted")   
+    def InsertResult(count=1):
+        print(Messages.prompt + f"{count} row{'s' if count != 1 else ''} inserted")
+    @staticmethod
+    def LoadDataFileError(fileName):
+        print(Messages.prompt + f"Load data has failed: cannot read '{fileName}'")
+    @staticmethod
+    def InsertDuplicatePrimaryKeyError():
+        print(Messages.prompt + "Insert has failed: primary key duplication")
+    @staticmethod
+    def InsertReferentialIntegrityError():
+        print(Messages.prompt + "Insert has failed: referential integrity violation")
     @staticmethod
     def InsertTypeMismatchError():
         print(Messages.prompt + "Insert has failed: types are not matched")
@@ -71,6 +329,24 @@ class Messages():
     def DeleteResult(count):
         print(Messages.prompt + f"{count} row{'s' if count != 1 else ''} deleted")
     @staticmethod
+    def DeleteReferentialIntegrityPassed(count):
+        print(Messages.prompt + f"{count} row{'s are' if count != 1 else ' is'} not deleted due to referential integrity")
+    @staticmethod
+    def UpdateResult(count):
+        print(Messages.prompt + f"{count} row{'s' if count != 1 else ''} updated")
+    @staticmethod
+    def UpdateTypeMismatchError():
+        print(Messages.prompt + "Update has failed: types are not matched")
+    @staticmethod
+    def UpdateColumnExistenceError(colName):
+        print(Messages.prompt + f"Update has failed: '{colName}' does not exist")
+    @staticmethod
+    def UpdateReferentialIntegrityError():
+        print(Messages.prompt + "Update has failed: referential integrity violation")
+    @staticmethod
+    def UpdateDuplicatePrimaryKeyError():
+        print(Messages.prompt + "Update has failed: primary key duplication")
+    @staticmethod
     def SelectTableExistenceError(tableName):
         print(Messages.prompt + f"Select has failed: '{tableName}' does not exist")
     @staticmethod
@@ -92,42 +368,1601 @@ class Messages():
     def IncomparableError():
         print(Messages.prompt + "Trying to compare incomparable columns or values")
 
+# comparison operators of the where clause
+COMP_OPS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+# comparison operator after swapping the operands (1 < a -> a > 1) / after applying NOT
+FLIPPED_COMP_OPS = {"=": "=", "!=": "!=", ">": "<", ">=": "<=", "<": ">", "<=": ">="}
+NEGATED_COMP_OPS = {"=": "!=", "!=": "=", ">": "<=", ">=": "<", "<": ">=", "<=": ">"}
+
+# null in a csv file (written by SET OUTPUT CSV, read by LOAD DATA), an empty field is an empty char value
+CSV_NULL = '\\N'
+# DATE and INT of grammar.lark, for values that are not parsed by the grammar (csv fields)
+DATE_PATTERN = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')
+INT_PATTERN = re.compile(r'[+-]?[0-9]+')
+
+def parse_date(text):
+    """Ordinal of a YYYY-MM-DD date, the form date values are stored and compared in.
+    raises ValueError for other forms (date.fromisoformat also accepts e.g. 20240101) and invalid dates"""
+    if not DATE_PATTERN.fullmatch(text):
+        raise ValueError(f"not a YYYY-MM-DD date: {text}")
+    return date.fromisoformat(text).toordinal()
+
+def format_date(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+def encode_index_value(value, column_type):
+    """Encode a column value as an index key, byte order of the keys equals the order of the values."""
+    if column_type in ('int', 'date'):
+        # flip the sign bit so that negative numbers come first (date is an ordinal)
+        return struct.pack('>Q', value + (1 << 63))
+    # char
+    return value.encode()
+
+def fits_index_key(value, column_type):
+    """False for an int/date value outside the 8 bytes of encode_index_value (a literal no stored value can reach)."""
+    return column_type not in ('int', 'date') or -(1 << 63) <= value < 1 << 63
+
+def encode_key(values, column_types):
+    """Encode a (composite) key such as a primary key, byte order of the keys equals the order of the value tuples.
+    every part is self-delimiting, so the key of a prefix of the columns is a prefix of the key"""
+    parts = []
+    for value, column_type in zip(values, column_types):
+        if column_type.startswith('char'):
+            # escape 0x00 and terminate with 0x00 0x00
+            parts.append(value.encode().replace(b'\x00', b'\x00\xff') + b'\x00\x00')
+        else:
+            # int and date have a fixed length
+            parts.append(encode_index_value(value, column_type))
+    return b''.join(parts)
+
+class RowCodec():
+    """Binary format of the rows of one table, the fields are positional (no column names in the rows).
+    [null bitmap][int: 8 bytes, date: 4 bytes (ordinal) of every int/date column][length + utf-8 bytes of every char column]
+    the fields of null values are kept (0 / empty), the bitmap tells them apart"""
+    def __init__(self, columns, columns_metadata):
+        self.columns = list(columns)
+        self.bitmap_size = (len(self.columns) + 7) // 8
+        self.null_bits = [(column, 1 << i) for i, column in enumerate(self.columns)]
+        self.fixed_columns = []
+        self.char_columns = [] # (column, struct of the length)
+        fixed_format = '>'
+        for column in self.columns:
+            column_type = columns_metadata[column]["type"]
+            if column_type == 'int':
+                self.fixed_columns.append(column)
+                fixed_format += 'q'
+            elif column_type == 'date':
+                self.fixed_columns.append(column)
+                fixed_format += 'i'
+            else:
+                # char(n) is at most 4n bytes in utf-8
+                max_bytes = 4 * int(column_type.split('(')[1].split(')')[0])
+                length = struct.Struct('>B' if max_bytes < 1 << 8 else '>H' if max_bytes < 1 << 16 else '>I')
+                self.char_columns.append((column, length))
+        self.fixed = struct.Struct(fixed_format)
+        # order of the decoded values
+        self.decoded_columns = self.fixed_columns + [column for column, _ in self.char_columns]
+
+    def encode(self, record):
+        bitmap = 0
+        for column, bit in self.null_bits:
+            if record[column] is None:
+                bitmap |= bit
+        parts = [bitmap.to_bytes(self.bitmap_size, 'little'),
+                 self.fixed.pack(*[0 if record[column] is None else record[column] for column in self.fixed_columns])]
+        for column, length in self.char_columns:
+            data = b'' if record[column] is None else record[column].encode()
+            parts.append(length.pack(len(data)))
+            parts.append(data)
+        return b''.join(parts)
+
+    def decode(self, data):
+        offset = self.bitmap_size
+        values = list(self.fixed.unpack_from(data, offset))
+        offset += self.fixed.size
+        for _, length in self.char_columns:
+            size = length.unpack_from(data, offset)[0]
+            offset += length.size
+            values.append(data[offset:offset + size].decode())
+            offset += size
+        record = dict(zip(self.decoded_columns, values))
+        bitmap = int.from_bytes(data[:self.bitmap_size], 'little')
+        if bitmap:
+            for column, bit in self.null_bits:
+                if bitmap & bit:
+                    record[column] = None
+        return record
+
+class ColumnarTable():
+    """Columnar layout of one table (CREATE TABLE ... USING COLUMNAR).
+    every column is stored in segments of COLUMNAR_SEGMENT_ROWS values under col:<table_name>:<column_name>:<segment>,
+    [number of values][null mask, 1 byte per value (0 = null)][array of the values]
+    int/date are array('q')/array('i') (0 for null), char is array('I') of the utf-8 lengths followed by the bytes.
+    the number of rows is kept under colrows:<table_name>, every segment but the last one is full.
+    a table with a primary key has an entry colkey:<table_name>:<encoded primary key> (no value) per row for the duplicate checks"""
+    def __init__(self, table_name, table_metadata):
+        self.table_name = table_name
+        self.columns = table_metadata["columns"]
+        self.column_types = {column: table_metadata["columns_metadata"][column]["type"] for column in self.columns}
+        self.key_columns = [column for column in self.columns if table_metadata["columns_metadata"][column]["primary_key"]]
+
+    def _segment_key(self, column, segment):
+        return f'col:{self.table_name}:{column}:{segment:08d}'.encode()
+
+    def row_count(self, flags=0):
+        value = myDB.get(f'colrows:{self.table_name}'.encode(), flags)
+        return int(value.decode()) if value else 0
+
+    def segment_count(self):
+        return -(-self.row_count() // COLUMNAR_SEGMENT_ROWS)
+
+    def read_segment(self, column, segment):
+        """(values, null mask) of one segment of a column, null values are 0 / '' in values"""
+        data = myDB.get(self._segment_key(column, segment))
+        count = struct.unpack_from('>I', data)[0]
+        mask = data[4:4 + count]
+        payload = data[4 + count:]
+        column_type = self.column_types[column]
+        if column_type in ('int', 'date'):
+            values = array('q' if column_type == 'int' else 'i')
+            values.frombytes(payload)
+            return values, mask
+        lengths = array('I')
+        lengths.frombytes(payload[:lengths.itemsize * count])
+        text = payload[lengths.itemsize * count:]
+        values = []
+        offset = 0
+        for length in lengths:
+            values.append(text[offset:offset + length].decode())
+            offset += length
+        return values, mask
+
+    def write_segment(self, column, segment, values):
+        """write one segment of a column, values is a list with None for null"""
+        mask = bytes(value is not None for value in values)
+        column_type = self.column_types[column]
+        if column_type in ('int', 'date'):
+            payload = array('q' if column_type == 'int' else 'i', [0 if value is None else value for value in values]).tobytes()
+        else:
+            data = [b'' if value is None else value.encode() for value in values]
+            payload = array('I', map(len, data)).tobytes() + b''.join(data)
+        myDB.put(self._segment_key(column, segment), struct.pack('>I', len(values)) + mask + payload)
+
+    def _column_values(self, column, segment):
+        """values of one segment of a column with None for null"""
+        values, mask = self.read_segment(column, segment)
+        if mask.count(0):
+            return [value if present else None for value, present in zip(values, mask)]
+        return list(values)
+
+    def select(self, segment, filters):
+        """selection mask (1 byte per row) of the rows of a segment satisfying all filters [(column, comp_op, value), ...]
+        the filters are evaluated on the whole column at once, None if there is no filter"""
+        selection = None
+        for column, comp_op, value in filters:
+            values, mask = self.read_segment(column, segment)
+            if mask.count(0):
+                # cannot compare null value
+                Messages.IncomparableError()
+                raise QueryError
+            selected = bytes(map(COMP_OPS[comp_op], values, itertools.repeat(value)))
+            selection = selected if selection is None else bytes(map(operator.and_, selection, selected))
+        return selection
+
+    def rows(self, filters=()):
+        """Iterate over the rows (records) in insertion order, the other columns are read only for the segments with selected rows."""
+        for segment in range(self.segment_count()):
+            selection = self.select(segment, filters) if filters else None
+            if selection is not None and not selection.count(1):
+                continue
+            columns = [self._column_values(column, segment) for column in self.columns]
+            records = zip(*columns)
+            if selection is not None:
+                records = itertools.compress(records, selection)
+            for values in records:
+                yield dict(zip(self.columns, values))
+
+    def _key(self, values):
+        """colkey:<table_name>:<encoded primary key> for the values of the primary key columns"""
+        return f'colkey:{self.table_name}:'.encode() + encode_key(values, [self.column_types[column] for column in self.key_columns])
+
+    def contains(self, record):
+        """True if a row has the primary key of record (one lookup of its colkey entry)"""
+        return myDB.get(self._key([record[column] for column in self.key_columns])) is not None
+
+    def add_keys(self, records):
+        """write the primary key entries of records (nothing for a table without primary key)"""
+        if self.key_columns:
+            for record in records:
+                myDB.put(self._key([record[column] for column in self.key_columns]), b'')
+
+    def extend(self, records):
+        """append records, the last segment is read once and every segment is written once"""
+        count = self.row_count(db.DB_RMW)
+        segment, offset = divmod(count, COLUMNAR_SEGMENT_ROWS)
+        for column in self.columns:
+            values = self._column_values(column, segment) if offset else []
+            current = segment
+            for record in records:
+                if len(values) == COLUMNAR_SEGMENT_ROWS:
+                    self.write_segment(column, current, values)
+                    current += 1
+                    values = []
+                values.append(record[column])
+            if values:
+                self.write_segment(column, current, values)
+        myDB.put(f'colrows:{self.table_name}'.encode(), str(count + len(records)).encode())
+        self.add_keys(records)
+
+    def rewrite(self, records):
+        """replace all rows of the table by records"""
+        self.drop()
+        for segment, start in enumerate(range(0, len(records), COLUMNAR_SEGMENT_ROWS)):
+            chunk = records[start:start + COLUMNAR_SEGMENT_ROWS]
+            for column in self.columns:
+                self.write_segment(column, segment, [record[column] for record in chunk])
+        myDB.put(f'colrows:{self.table_name}'.encode(), str(len(records)).encode())
+        self.add_keys(records)
+
+    def delete(self, predicate=None, deleted=None):
+        """delete the rows satisfying predicate (all rows if None), returns the number of deleted rows
+        the deleted records are appended to the list deleted (if given, with a predicate)"""
+        count = self.row_count()
+        if predicate is None:
+            self.drop()
+            return count
+        kept = []
+        for record in self.rows():
+            if not predicate(record):
+                kept.append(record)
+            elif deleted is not None:
+                deleted.append(record)
+        if len(kept) != count:
+            self.rewrite(kept)
+        return count - len(kept)
+
+    def update(self, column, value, predicate=None, old_values=None):
+        """set column to value in the rows satisfying predicate (all rows if None), returns the number of updated rows.
+        only the segments of column with a changed value are written, the primary key must stay unique
+        (the colkey entries of the changed rows are moved), the replaced values are appended to the list old_values (if given)"""
+        count = 0
+        segments = {}
+        # primary key values of the changed rows before and after the update
+        old_keys = []
+        new_keys = []
+        for segment in range(self.segment_count()):
+            values = self._column_values(column, segment)
+            if predicate is None:
+                selection = [True] * len(values)
+            else:
+                columns = [values if name == column else self._column_values(name, segment) for name in self.columns]
+                selection = [predicate(dict(zip(self.columns, row))) for row in zip(*columns)]
+            count += selection.count(True)
+            new_values = [value if selected else old for old, selected in zip(values, selection)]
+            if new_values != values:
+                segments[segment] = new_values
+                if old_values is not None:
+                    old_values.extend(old for old, new in zip(values, new_values) if old != new)
+                if column in self.key_columns:
+                    old_columns = [values if name == column else self._column_values(name, segment) for name in self.key_columns]
+                    new_columns = [new_values if name == column else old_column for name, old_column in zip(self.key_columns, old_columns)]
+                    changed = [old != new for old, new in zip(values, new_values)]
+                    old_keys.extend(itertools.compress(zip(*old_columns), changed))
+                    new_keys.extend(itertools.compress(zip(*new_columns), changed))
+
+        for key in old_keys:
+            myDB.delete(self._key(key))
+        for key in new_keys:
+            if myDB.get(self._key(key)) is not None:
+                Messages.UpdateDuplicatePrimaryKeyError()
+                raise QueryError
+            myDB.put(self._key(key), b'')
+
+        for segment, new_values in segments.items():
+            self.write_segment(column, segment, new_values)
+        return count
+
+    def drop(self):
+        keys = [key for key, _ in iter_prefix(f'col:{self.table_name}:'.encode())]
+        keys += [key for key, _ in iter_prefix(f'colkey:{self.table_name}:'.encode())]
+        for key in keys:
+            myDB.delete(key)
+        if myDB.get(f'colrows:{self.table_name}'.encode()) is not None:
+            myDB.delete(f'colrows:{self.table_name}'.encode())
+
+def hll_hash(value):
+    """64 bit hash of a column value, the same in every process (unlike hash() of a str)"""
+    if isinstance(value, int):
+        # splitmix64 finalizer
+        h = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        return h ^ (h >> 31)
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+def hll_estimate(registers):
+    """HyperLogLog estimate of the number of distinct values (linear counting for small sets)"""
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -register for register in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return estimate
+
+class TableStatistics():
+    """Statistics of a table for the planner, a json object under stats:<table_name>.
+    the row count and the null count of each column are exact (updated by every insert/delete),
+    distinct values are estimated with a HyperLogLog of each column (its registers under hll:<table_name>:<column>),
+    int/date columns also keep min/max and an equi-depth histogram (bounds of HISTOGRAM_BUCKETS buckets with the same
+    number of rows) built by ANALYZE.
+    an insert only widens min/max and a delete keeps its values in them and in the HyperLogLog until the next ANALYZE"""
+    def __init__(self, table_name, table_metadata, data=None, flags=0):
+        self.table_name = table_name
+        self.column_types = {column: table_metadata["columns_metadata"][column]["type"] for column in table_metadata["columns"]}
+        # read flags of the registers (DB_RMW when the statistics are updated)
+        self.flags = flags
+        self._registers = {} # column -> bytearray of the HyperLogLog, read on first use
+        self._changed = set() # columns whose registers have to be written
+        # "modified" counts the rows inserted/deleted/updated since the last ANALYZE (see _fraction_below)
+        self.data = data or self._empty_data()
+
+    def _empty_data(self):
+        for column in self.column_types:
+            self._registers[column] = bytearray(1 << HLL_PRECISION)
+            self._changed.add(column)
+        columns = {column: {"nulls": 0, "min": None, "max": None, "histogram": None} for column in self.column_types}
+        return {"rows": 0, "modified": 0, "columns": columns}
+
+    @staticmethod
+    def load(table_name, table_metadata, flags=0):
+        value = myDB.get(f'stats:{table_name}'.encode(), flags)
+        data = None if value is None else json.loads(value.decode())
+        return TableStatistics(table_name, table_metadata, data, flags)
+
+    def save(self):
+        myDB.put(f'stats:{self.table_name}'.encode(), json.dumps(self.data).encode())
+        for column in self._changed:
+            myDB.put(f'hll:{self.table_name}:{column}'.encode(), bytes(self._registers[column]))
+        self._changed = set()
+
+    @staticmethod
+    def drop(table_name):
+        keys = [key for key, _ in iter_prefix(f'hll:{table_name}:'.encode())]
+        keys += [f'stats:{table_name}'.encode()] if myDB.get(f'stats:{table_name}'.encode()) is not None else []
+        for key in keys:
+            myDB.delete(key)
+
+    @property
+    def rows(self):
+        return self.data["rows"]
+
+    def _hll(self, column):
+        registers = self._registers.get(column)
+        if registers is None:
+            value = myDB.get(f'hll:{self.table_name}:{column}'.encode(), self.flags)
+            registers = self._registers[column] = bytearray(value or bytes(1 << HLL_PRECISION))
+        return registers
+
+    def _add_values(self, column, values):
+        """add non-null values of a column to its HyperLogLog and min/max"""
+        if not values:
+            return
+        shift = 64 - HLL_PRECISION
+        mask = (1 << shift) - 1
+        registers = self._hll(column)
+        for value in set(values):
+            h = hll_hash(value)
+            # register of the first HLL_PRECISION bits, rank of the first 1 bit in the others
+            rank = shift - (h & mask).bit_length() + 1
+            if rank > registers[h >> shift]:
+                registers[h >> shift] = rank
+                self._changed.add(column)
+        if self.column_types[column] in ('int', 'date'):
+            stats = self.data["columns"][column]
+            low, high = min(values), max(values)
+            stats["min"] = low if stats["min"] is None else min(stats["min"], low)
+            stats["max"] = high if stats["max"] is None else max(stats["max"], high)
+
+    def add(self, records):
+        """count the inserted records"""
+        for column in self.column_types:
+            values = [record[column] for record in records if record[column] is not None]
+            self.data["columns"][column]["nulls"] += len(records) - len(values)
+            self._add_values(column, values)
+        self.data["rows"] += len(records)
+        self.data["modified"] += len(records)
+
+    def remove(self, records):
+        """count the deleted records"""
+        for column in self.column_types:
+            self.data["columns"][column]["nulls"] -= sum(1 for record in records if record[column] is None)
+        self.data["rows"] -= len(records)
+        self.data["modified"] += len(records)
+
+    def change(self, column, old_values, value):
+        """count an UPDATE of column from old_values to value (not null), one old value per updated row"""
+        self.data["columns"][column]["nulls"] -= sum(1 for old_value in old_values if old_value is None)
+        self._add_values(column, [value] if old_values else [])
+        self.data["modified"] += len(old_values)
+
+    def rebuild(self, records):
+        """compute all statistics again from the records of the table (ANALYZE)"""
+        self.data = self._empty_data()
+        self.add(records)
+        self.data["modified"] = 0
+        for column, column_type in self.column_types.items():
+            if column_type not in ('int', 'date'):
+                continue
+            values = sorted(record[column] for record in records if record[column] is not None)
+            if values:
+                buckets = min(HISTOGRAM_BUCKETS, len(values))
+                self.data["columns"][column]["histogram"] = [values[round(i * (len(values) - 1) / buckets)] for i in range(buckets + 1)]
+
+    def has_nulls(self, column):
+        return self.data["columns"][column]["nulls"] > 0
+
+    def null_fraction(self, column):
+        return self.data["columns"][column]["nulls"] / self.rows if self.rows else 0.0
+
+    def distinct(self, column):
+        """estimated number of distinct non-null values of the column"""
+        non_null = self.rows - self.data["columns"][column]["nulls"]
+        if non_null <= 0:
+            return 0
+        return max(1, min(non_null, round(hll_estimate(self._hll(column)))))
+
+    def _fraction_below(self, column, value):
+        """estimated fraction of the non-null values < value (histogram, or uniform between min and max)"""
+        stats = self.data["columns"][column]
+        # the histogram does not follow inserts/deletes like min/max, after many of them the bounds are wrong
+        stale = self.data["modified"] > STALE_HISTOGRAM_FRACTION * self.rows
+        bounds = (not stale and stats["histogram"]) or ([stats["min"], stats["max"]] if stats["min"] is not None else None)
+        if bounds is None:
+            return DEFAULT_SELECTIVITY
+        if value <= bounds[0]:
+            return 0.0
+        if value > bounds[-1]:
+            return 1.0
+        i = bisect.bisect_left(bounds, value) - 1
+        low, high = bounds[i], bounds[i + 1]
+        part = (value - low) / (high - low) if high > low else 1.0
+        return (i + part) / (len(bounds) - 1)
+
+    def selectivity(self, column, comp_op, value):
+        """estimated fraction of the rows satisfying '<column> comp_op value' (value as stored, e.g. a date ordinal)"""
+        if not self.rows:
+            return 0.0
+        non_null = 1.0 - self.null_fraction(column)
+        distinct = self.distinct(column)
+        equal = non_null / distinct if distinct else 0.0
+        stats = self.data["columns"][column]
+        if stats["min"] is not None and not stats["min"] <= value <= stats["max"]:
+            equal = 0.0
+        if comp_op == "=":
+            return equal
+        if comp_op == "!=":
+            return max(0.0, non_null - equal)
+        if not isinstance(value, int):
+            # char columns are compared only with = / !=
+            return DEFAULT_SELECTIVITY
+        below = self._fraction_below(column, value) * non_null
+        if comp_op == "<":
+            return below
+        if comp_op == "<=":
+            return min(non_null, below + equal)
+        if comp_op == ">":
+            return max(0.0, non_null - below - equal)
+        return max(0.0, non_null - below) # >=
+
+def index_file_name(index_name):
+    return f'myDB.{index_name}.idx'
+
+def open_index(index_name, table_name, column_name, row_codec, column_type, create=False):
+    """Open the secondary btree of an index and associate it with myDB.
+    with create=True the index file is created and filled with the existing rows."""
+    prefix = f'row:{table_name}:'.encode()
+
+    def get_index_key(key, data):
+        # called by berkeleydb for every put/delete on myDB
+        if not key.startswith(prefix):
+            return db.DB_DONOTINDEX
+        value = row_codec.decode(data)[column_name]
+        if value is None:
+            # null values are not indexed
+            return db.DB_DONOTINDEX
+        return encode_index_value(value, column_type)
+
+    myIndexes[index_name] = associate_index(index_file_name(index_name), get_index_key, create)
+
+def close_index(index_name, remove=False):
+    """Close (and remove the file of) an index."""
+    myIndexes.pop(index_name).close()
+    if remove:
+        myEnv.dbremove(index_file_name(index_name), txn=myTransactions.current)
+
+def associate_index(file_name, get_index_key, create=False):
+    """Open a secondary btree (sorted duplicates) and associate it with myDB, get_index_key(key, data) is its key of a row."""
+    indexDB = db.DB(myEnv)
+    indexDB.set_flags(db.DB_DUP | db.DB_DUPSORT)
+    indexDB.open(file_name, dbtype=db.DB_BTREE, flags=db.DB_CREATE if create else 0, txn=myTransactions.current)
+    myDB.associate(indexDB, get_index_key, flags=db.DB_CREATE if create else 0)
+    return indexDB
+
+def reference_index_file_name(table_name, ref_table_name):
+    return f'myDB.{table_name}.{ref_table_name}.fk'
+
+def open_reference_index(table_name, ref_table_name, columns, column_types, row_codec, create=False):
+    """Open the foreign key index of table_name on the columns referencing ref_table_name (in its primary key order).
+    the index key is the encoded foreign key, the same bytes as the primary key part of the referenced row key,
+    rows with a null in the foreign key reference nothing and are not indexed"""
+    prefix = f'row:{table_name}:'.encode()
+
+    def get_index_key(key, data):
+        if not key.startswith(prefix):
+            return db.DB_DONOTINDEX
+        record = row_codec.decode(data)
+        values = [record[column] for column in columns]
+        if any(value is None for value in values):
+            return db.DB_DONOTINDEX
+        return encode_key(values, column_types)
+
+    file_name = reference_index_file_name(table_name, ref_table_name)
+    myReferenceIndexes[(table_name, ref_table_name)] = associate_index(file_name, get_index_key, create)
+
+def close_reference_index(table_name, ref_table_name, remove=False):
+    """Close (and remove the file of) a foreign key index."""
+    myReferenceIndexes.pop((table_name, ref_table_name)).close()
+    if remove:
+        myEnv.dbremove(reference_index_file_name(table_name, ref_table_name), txn=myTransactions.current)
+
+def iter_prefix(prefix):
+    """Iterate over (key, value) of the keys starting with prefix (bytes), seeking the btree cursor to the first one."""
+    cursor = myDB.cursor()
+    try:
+        x = cursor.set_range(prefix)
+        while x is not None and x[0].startswith(prefix):
+            yield x
+            x = cursor.next()
+    finally:
+        myTransactions.close_cursor(cursor)
+
+class Catalog():
+    """In-memory copy of the metadata (schema:, reference:, index: keys), loaded once at startup.
+    DDL writes through the put/delete methods, so the database and the cache never disagree.
+    every change increments meta:catalog_version, other processes reload the catalog when it differs from theirs"""
+    def __init__(self):
+        self.version = 0
+        self.tables = {} # table_name -> schema metadata
+        self.references = {} # (table_name, referenced table_name) -> {column: referenced column}
+        self.indexes = {} # index_name -> index metadata
+        self.row_codecs = {} # table_name -> RowCodec, built on first use
+
+    def _load_prefix(self, prefix):
+        """(key without prefix, json value) of the keys starting with prefix"""
+        return [(key.decode()[len(prefix):], json.loads(value.decode())) for key, value in iter_prefix(prefix.encode())]
+
+    def _stored_version(self):
+        value = myDB.get(b'meta:catalog_version')
+        return int(value.decode()) if value else 0
+
+    def _changed(self):
+        self.version = self._stored_version() + 1
+        myDB.put(b'meta:catalog_version', str(self.version).encode())
+
+    def is_stale(self):
+        """True if another process has changed the metadata since it was loaded"""
+        return self._stored_version() != self.version
+
+    def load(self):
+        self.version = self._stored_version()
+        self.row_codecs = {}
+        self.tables = dict(self._load_prefix('schema:'))
+        self.references = {tuple(key.split(':')): value for key, value in self._load_prefix('reference:')}
+        self.indexes = dict(self._load_prefix('index:'))
+
+    def table_names(self):
+        return sorted(self.tables)
+
+    def get_table(self, table_name):
+        return self.tables.get(table_name)
+
+    def put_table(self, table_name, table_metadata):
+        myDB.put(f'schema:{table_name}'.encode(), json.dumps(table_metadata).encode())
+        self._changed()
+        self.tables[table_name] = table_metadata
+        self.row_codecs.pop(table_name, None)
+
+    def delete_table(self, table_name):
+        myDB.delete(f'schema:{table_name}'.encode())
+        self._changed()
+        del self.tables[table_name]
+        self.row_codecs.pop(table_name, None)
+
+    def row_codec(self, table_name):
+        codec = self.row_codecs.get(table_name)
+        if codec is None:
+            table_metadata = self.tables[table_name]
+            codec = self.row_codecs[table_name] = RowCodec(table_metadata["columns"], table_metadata["columns_metadata"])
+        return codec
+
+    def put_reference(self, table_name, ref_table_name, columns):
+        # referenced_by:<ref_table_name>:<table_name> is the reverse mapping (checked by DROP TABLE)
+        myDB.put(f'reference:{table_name}:{ref_table_name}'.encode(), json.dumps(columns).encode())
+        myDB.put(f'referenced_by:{ref_table_name}:{table_name}'.encode(), b'')
+        self._changed()
+        self.references[(table_name, ref_table_name)] = columns
+
+    def delete_reference(self, table_name, ref_table_name):
+        myDB.delete(f'reference:{table_name}:{ref_table_name}'.encode())
+        myDB.delete(f'referenced_by:{ref_table_name}:{table_name}'.encode())
+        self._changed()
+        del self.references[(table_name, ref_table_name)]
+
+    def get_index(self, index_name):
+        return self.indexes.get(index_name)
+
+    def put_index(self, index_name, index_metadata):
+        myDB.put(f'index:{index_name}'.encode(), json.dumps(index_metadata).encode())
+        self._changed()
+        self.indexes[index_name] = index_metadata
+
+    def delete_index(self, index_name):
+        myDB.delete(f'index:{index_name}'.encode())
+        self._changed()
+        del self.indexes[index_name]
+
 class QueryError(Exception):
     """Custom exception class for query errors."""
     pass
 
+# operators of the select query
+# each operator is iterable and pulls the rows of its children one by one (rows are {<alias>.<column>: value})
+class Operator(ABC):
+    """Base class of the query operators."""
+    def __init__(self, *children):
+        self.children = list(children)
+        # rows expected by the planner (from the table statistics), shown by EXPLAIN
+        self.estimated_rows = None
+
+    @abstractmethod
+    def __iter__(self):
+        """rows of the operator"""
+
+    def label(self):
+        """one line description of the operator for EXPLAIN"""
+        return type(self).__name__
+
+class Profiled(Operator):
+    """EXPLAIN ANALYZE wrapper of an operator, counts the rows it produces and the time spent producing them
+    (including the time of its children, like the actual time of each node of a plan)"""
+    def __init__(self, child):
+        super().__init__(child)
+        self.rows = 0
+        self.seconds = 0.0
+
+    def __iter__(self):
+        start = time.perf_counter()
+        # some operators do their work when the iteration starts (e.g. TopN)
+        iterator = iter(self.children[0])
+        self.seconds += time.perf_counter() - start
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(iterator)
+            except StopIteration:
+                self.seconds += time.perf_counter() - start
+                return
+            self.seconds += time.perf_counter() - start
+            self.rows += 1
+            yield row
+
+def profile(plan):
+    """wrap every operator of the plan in Profiled (the children of the operators are replaced)"""
+    plan.children = [profile(child) for child in plan.children]
+    return Profiled(plan)
+
+def print_plan(plan, depth=0):
+    """Print the operator tree of a plan (EXPLAIN), with rows and time of each operator if it has been profiled."""
+    if isinstance(plan, Profiled):
+        operator_ = plan.children[0]
+        rows_in = sum(child.rows for child in operator_.children)
+        line = f"{operator_.label()} (rows in={rows_in} out={plan.rows} time={plan.seconds * 1000:.3f} ms)"
+    else:
+        operator_ = plan
+        line = operator_.label()
+    if operator_.estimated_rows is not None:
+        line += f" (estimated rows={operator_.estimated_rows:.0f})"
+    print("  " * depth + ("-> " if depth else "") + line)
+    for child in operator_.children:
+        print_plan(child, depth + 1)
+
+def describe_filters(column_types, filters):
+    """text of columnar filters [(column, comp_op, value), ...]"""
+    texts = []
+    for column, comp_op, value in filters:
+        if column_types[column] == 'date':
+            value = format_date(value)
+        elif column_types[column].startswith('char'):
+            value = f"'{value}'"
+        texts.append(f"{column} {comp_op} {value}")
+    return " and ".join(texts)
+
+class TableScan(Operator):
+    """Rows of one table, read with a full scan or an index (access path of _find_index_access)."""
+    def __init__(self, transformer, table_name, alias, columns, access=None):
+        super().__init__()
+        self.transformer = transformer
+        self.table_name = table_name
+        self.alias = alias
+        self.keys = {column: f"{alias}.{column}" for column in columns}
+        self.access = access
+
+    def __iter__(self):
+        keys = self.keys
+        for _, record in self.transformer._scan_access(self.table_name, self.access):
+            yield {keys[column]: value for column, value in record.items()}
+
+    def label(self):
+        name = self.table_name if self.alias == self.table_name else f"{self.table_name} {self.alias}"
+        if self.access is None:
+            return f"TableScan {name} [full scan]"
+        access_type, index_name, _, _, description = self.access
+        if access_type == "primary key":
+            return f"TableScan {name} [primary key: {description}]"
+        return f"TableScan {name} [index {index_name}: {description}]"
+
+class ColumnarScan(Operator):
+    """Rows of a columnar table, filters [(column, comp_op, value), ...] are evaluated column at a time before the rows are built."""
+    def __init__(self, table, alias, filters=()):
+        super().__init__()
+        self.table = table
+        self.keys = {column: f"{alias}.{column}" for column in table.columns}
+        self.filters = filters
+
+    def __iter__(self):
+        keys = self.keys
+        for record in self.table.rows(self.filters):
+            yield {keys[column]: value for column, value in record.items()}
+
+    def label(self):
+        if not self.filters:
+            return f"ColumnarScan {self.table.table_name} [all columns]"
+        return f"ColumnarScan {self.table.table_name} [column filters: {describe_filters(self.table.column_types, self.filters)}]"
+
+class Filter(Operator):
+    """Rows of the child that satisfy the predicate (description is the condition shown by EXPLAIN)."""
+    def __init__(self, child, predicate, description=""):
+        super().__init__(child)
+        self.predicate = predicate
+        self.description = description
+
+    def __iter__(self):
+        return filter(self.predicate, self.children[0])
+
+    def label(self):
+        return f"Filter ({self.description})"
+
+class HashJoin(Operator):
+    """Equi-join on key_pairs [(left key, right key), ...].
+    the hash table is built on the right side, then the rows of the left side probe it as they arrive.
+    strict_keys are the positions of the pairs coming from a where comparison: a null value there cannot be compared
+    (error if the other side has rows), the pairs of a join ... on condition simply compare the values"""
+    def __init__(self, left, right, key_pairs, strict_keys=()):
+        super().__init__(left, right)
+        self.left_keys = [left_key for left_key, _ in key_pairs]
+        self.right_keys = [right_key for _, right_key in key_pairs]
+        self.strict_keys = list(strict_keys)
+
+    def __iter__(self):
+        left, right = self.children
+        hash_table = {}
+        right_rows = 0
+        null_key = False
+        for row in right:
+            right_rows += 1
+            key = tuple(row[k] for k in self.right_keys)
+            if any(key[i] is None for i in self.strict_keys):
+                null_key = True
+                continue
+            hash_table.setdefault(key, []).append(row)
+        for row in left:
+            key = tuple(row[k] for k in self.left_keys)
+            if null_key or (right_rows and any(key[i] is None for i in self.strict_keys)):
+                # cannot compare null value
+                Messages.IncomparableError()
+                raise QueryError
+            for match in hash_table.get(key, ()):
+                yield {**row, **match}
+
+    def label(self):
+        keys = " and ".join(f"{left_key} = {right_key}" for left_key, right_key in zip(self.left_keys, self.right_keys))
+        return f"HashJoin ({keys}) [build: right, probe: left]"
+
+class NestedLoopJoin(Operator):
+    """Cartesian product, the right side is read once and kept in memory."""
+    def __iter__(self):
+        left, right = self.children
+        right_rows = None
+        for row in left:
+            if right_rows is None:
+                right_rows = list(right)
+            for match in right_rows:
+                yield {**row, **match}
+
+    def label(self):
+        return "NestedLoopJoin (cartesian product) [right side kept in memory]"
+
+def order_joins(sizes, edges, filters):
+    """Choose the order in which relations 0..n-1 are joined, minimizing the sum of the estimated intermediate rows.
+    sizes: estimated rows of each relation, edges: [(i, j, selectivity), ...] equi-join predicates,
+    filters: [(set of relations, selectivity), ...] other predicates on several relations.
+    a set of relations connected by join predicates is only split along a predicate (no cartesian product inside it),
+    unconnected sets are combined with cartesian products. dynamic programming over the subsets for up to DP_JOIN_TABLES
+    relations, greedy (join the connected relation giving the fewest rows) above.
+    returns (join tree: relation index or (tree, tree), {subset bit mask: estimated rows})"""
+    n = len(sizes)
+    neighbors = [0] * n
+    for i, j, _ in edges:
+        neighbors[i] |= 1 << j
+        neighbors[j] |= 1 << i
+    filter_masks = [(sum(1 << i for i in relations), selectivity) for relations, selectivity in filters]
+    rows = {}
+
+    def estimate(mask):
+        if mask not in rows:
+            estimate = 1.0
+            for i in range(n):
+                if mask >> i & 1:
+                    estimate *= sizes[i]
+            for i, j, selectivity in edges:
+                if mask >> i & 1 and mask >> j & 1:
+                    estimate *= selectivity
+            for filter_mask, selectivity in filter_masks:
+                if filter_mask and filter_mask & mask == filter_mask:
+                    estimate *= selectivity
+            rows[mask] = estimate
+        return rows[mask]
+
+    def connects(mask1, mask2):
+        return any(neighbors[i] & mask2 for i in range(n) if mask1 >> i & 1)
+
+    def is_connected(mask):
+        reached = mask & -mask
+        while True:
+            grown = reached
+            for i in range(n):
+                if reached >> i & 1:
+                    grown |= neighbors[i] & mask
+            if grown == reached:
+                return reached == mask
+            reached = grown
+
+    for i in range(n):
+        estimate(1 << i)
+
+    if n <= DP_JOIN_TABLES:
+        # best[mask] = (cost, tree)
+        best = {1 << i: (0.0, i) for i in range(n)}
+        for mask in range(1, 1 << n):
+            if mask in best:
+                continue
+            connected = is_connected(mask)
+            result = None
+            sub = (mask - 1) & mask
+            while sub:
+                other = mask ^ sub
+                # each split once, the build side is chosen when the plan is built
+                if sub > other and connects(sub, other) == connected and (not connected or (is_connected(sub) and is_connected(other))):
+                    cost = best[sub][0] + best[other][0] + estimate(mask)
+                    if result is None or cost < result[0]:
+                        result = (cost, (best[sub][1], best[other][1]))
+                sub = (sub - 1) & mask
+            best[mask] = result
+        return best[(1 << n) - 1][1], rows
+
+    # greedy: start from the smallest relation, add the connected relation with the fewest joined rows
+    current = min(range(n), key=lambda i: sizes[i])
+    tree, mask = current, 1 << current
+    while mask != (1 << n) - 1:
+        remaining = [i for i in range(n) if not mask >> i & 1]
+        connected = [i for i in remaining if neighbors[i] & mask]
+        following = min(connected or remaining, key=lambda i: estimate(mask | 1 << i))
+        tree, mask = (tree, following), mask | 1 << following
+    return tree, rows
+
+class DescendingKey():
+    """Sort key wrapper that reverses the order of the wrapped key."""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+def describe_sort_keys(sort_keys):
+    return ", ".join(f"{key} {'desc' if descending else 'asc'}" for key, descending in sort_keys)
+
+def make_sort_key(sort_keys):
+    """One composite key function for sort_keys [(row key, descending), ...]."""
+    def sort_key(row):
+        key = []
+        for column, descending in sort_keys:
+            # When doing an ORDER BY, NULL values are presented first if you do ORDER BY ... ASC and last if you do ORDER BY ... DESC.
+            # smallest 한 값으로 처리
+            value = row[column]
+            part = (0, None) if value is None else (1, value)
+            key.append(DescendingKey(part) if descending else part)
+        return tuple(key)
+    return sort_key
+
+class Sort(Operator):
+    """Sort the rows by sort_keys [(row key, descending), ...] (blocking).
+    rows over the memory budget are sorted in runs, spilled to temporary files and k-way merged"""
+    def __init__(self, child, sort_keys, memory_rows=None):
+        super().__init__(child)
+        self.sort_keys = sort_keys
+        self.memory_rows = memory_rows or SORT_MEMORY_ROWS
+
+    def __iter__(self):
+        sort_key = make_sort_key(self.sort_keys)
+        runs = []
+        try:
+            rows = []
+            for row in self.children[0]:
+                rows.append(row)
+                if len(rows) >= self.memory_rows:
+                    rows.sort(key=sort_key)
+                    runs.append(self._spill(rows))
+                    rows = []
+            rows.sort(key=sort_key)
+            if not runs:
+                yield from rows
+                return
+            # heapq.merge is stable: equal keys come from the earlier run first
+            yield from heapq.merge(*(self._read_run(run) for run in runs), rows, key=sort_key)
+        finally:
+            for run in runs:
+                run.close()
+
+    def label(self):
+        return f"Sort ({describe_sort_keys(self.sort_keys)}) [runs of {self.memory_rows} rows]"
+
+    @staticmethod
+    def _spill(rows):
+        """write one sorted run to a temporary file (deleted on close)"""
+        run = tempfile.TemporaryFile()
+        for row in rows:
+            pickle.dump(row, run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        return run
+
+    @staticmethod
+    def _read_run(run):
+        while True:
+            try:
+                yield pickle.load(run)
+            except EOFError:
+                return
+
+class TopN(Operator):
+    """Rows offset..offset+limit of the child sorted by sort_keys, keeps only offset+limit rows in a heap."""
+    def __init__(self, child, sort_keys, limit, offset=0):
+        super().__init__(child)
+        self.sort_keys = sort_keys
+        self.limit = limit
+        self.offset = offset
+
+    def __iter__(self):
+        # heapq.nsmallest is stable (same result as sorted(...)[:n])
+        rows = heapq.nsmallest(self.offset + self.limit, self.children[0], key=make_sort_key(self.sort_keys))
+        return iter(rows[self.offset:])
+
+    def label(self):
+        return f"TopN ({describe_sort_keys(self.sort_keys)}) [limit {self.limit} offset {self.offset}]"
+
+class Limit(Operator):
+    """Rows offset..offset+limit of the child, stops pulling rows once the limit is reached."""
+    def __init__(self, child, limit, offset=0):
+        super().__init__(child)
+        self.limit = limit
+        self.offset = offset
+
+    def __iter__(self):
+        return itertools.islice(self.children[0], self.offset, self.offset + self.limit)
+
+    def label(self):
+        return f"Limit [limit {self.limit} offset {self.offset}]"
+
+class Project(Operator):
+    """Values of the selected columns [(row key, column type), ...] as tuples, dates are formatted here."""
+    def __init__(self, child, columns):
+        super().__init__(child)
+        self.columns = columns
+
+    def __iter__(self):
+        keys = [key for key, _ in self.columns]
+        date_positions = [i for i, (_, column_type) in enumerate(self.columns) if column_type == 'date']
+        for row in self.children[0]:
+            values = [row[key] for key in keys]
+            for i in date_positions:
+                if values[i] is not None:
+                    values[i] = format_date(values[i])
+            yield tuple(values)
+
+    def label(self):
+        return f"Project ({', '.join(key for key, _ in self.columns)})"
+
+class Aggregate(Operator):
+    """Aggregate functions over all rows (no group by), yields one tuple of formatted values.
+    aggregates are [(function, row key, column type), ...], the row key of count(*) is None"""
+    def __init__(self, child, aggregates):
+        super().__init__(child)
+        self.aggregates = aggregates
+
+    def __iter__(self):
+        count = 0
+        # aggregate of the non-null values of each column (None until the first non-null value)
+        states = [None] * len(self.aggregates)
+        for row in self.children[0]:
+            count += 1
+            for i, (func, key, column_type) in enumerate(self.aggregates):
+                if key is None or func == 'count' or (func == 'sum' and column_type != 'int'):
+                    continue
+                value = row[key]
+                if value is None:
+                    continue
+                state = states[i]
+                if state is None:
+                    states[i] = value
+                elif func == 'sum':
+                    states[i] = state + value
+                elif func == 'max':
+                    if value > state:
+                        states[i] = value
+                elif value < state: # min
+                    states[i] = value
+
+        yield format_aggregates(self.aggregates, count, states)
+
+    def label(self):
+        return f"Aggregate ({describe_aggregates(self.aggregates)})"
+
+class ColumnarAggregate(Operator):
+    """Aggregate of a columnar table without reading the rows: only the aggregated columns are read,
+    one segment (array) at a time, and reduced with sum/max/min over the whole array.
+    aggregates are (function, column, column type) like Aggregate, filters like ColumnarScan"""
+    def __init__(self, table, aggregates, filters=()):
+        super().__init__()
+        self.table = table
+        self.aggregates = aggregates
+        self.filters = filters
+
+    def __iter__(self):
+        count = 0
+        states = [None] * len(self.aggregates)
+        for segment in range(self.table.segment_count()):
+            selection = self.table.select(segment, self.filters) if self.filters else None
+            if selection is None:
+                count += min(COLUMNAR_SEGMENT_ROWS, self.table.row_count() - segment * COLUMNAR_SEGMENT_ROWS)
+            else:
+                count += selection.count(1)
+            for i, (func, column, column_type) in enumerate(self.aggregates):
+                if column is None or func == 'count' or (func == 'sum' and column_type != 'int'):
+                    continue
+                values, mask = self.table.read_segment(column, segment)
+                if selection is not None:
+                    mask = bytes(map(operator.and_, mask, selection))
+                if mask.count(0):
+                    values = list(itertools.compress(values, mask))
+                if not values:
+                    continue
+                if func == 'sum':
+                    value = sum(values)
+                    states[i] = value if states[i] is None else states[i] + value
+                elif func == 'max':
+                    value = max(values)
+                    states[i] = value if states[i] is None else max(states[i], value)
+                else: # min
+                    value = min(values)
+                    states[i] = value if states[i] is None else min(states[i], value)
+        yield format_aggregates(self.aggregates, count, states)
+
+    def label(self):
+        filters = ""
+        if self.filters:
+            filters = f", column filters: {describe_filters(self.table.column_types, self.filters)}"
+        return f"ColumnarAggregate {self.table.table_name} ({describe_aggregates(self.aggregates)}) [segment arrays{filters}]"
+
+class MetadataAggregate(Operator):
+    """Aggregate answered without reading the rows: the row count of each table comes from its statistics
+    (exact, updated by every insert/delete), min/max of a column from the first/last entry of its index or of the row keys.
+    tables are {alias: table name} (the count of several tables is the size of their cartesian product),
+    aggregates are (function, row key, column type) like Aggregate, only count/count(*)/max/min"""
+    def __init__(self, transformer, tables, aggregates):
+        super().__init__()
+        self.transformer = transformer
+        self.tables = tables
+        self.aggregates = aggregates
+
+    def __iter__(self):
+        count = 1
+        for table_name in self.tables.values():
+            count *= self.transformer._table_statistics(table_name).rows
+        states = [None] * len(self.aggregates)
+        for i, (func, key, _) in enumerate(self.aggregates):
+            if func in ('max', 'min') and count:
+                alias, column_name = key.split('.', 1)
+                states[i] = self.transformer._column_endpoint(self.tables[alias], column_name, func == 'max')
+        yield format_aggregates(self.aggregates, count, states)
+
+    def label(self):
+        sources = [f"rows of {table_name}: statistics" for table_name in dict.fromkeys(self.tables.values())]
+        for func, key, _ in self.aggregates:
+            if func in ('max', 'min'):
+                alias, column_name = key.split('.', 1)
+                table_name = self.tables[alias]
+                index_name = self.transformer._endpoint_index(self.transformer._get_table_metadata(table_name), column_name)
+                entry = "last" if func == 'max' else "first"
+                source = "primary key" if index_name == "PRIMARY" else f"index {index_name}"
+                sources.append(f"{func}({key}): {entry} entry of {source}")
+        return f"MetadataAggregate ({describe_aggregates(self.aggregates)}) [no scan, {', '.join(sources)}]"
+
+def describe_aggregates(aggregates):
+    return ", ".join("count(*)" if key is None else f"{func}({key})" for func, key, _ in aggregates)
+
+def format_aggregates(aggregates, count, states):
+    """Values of the aggregates from the row count and the aggregate of the non-null values of each column."""
+    result = []
+    for (func, key, column_type), state in zip(aggregates, states):
+        if func in ('count(*)', 'count'):
+            result.append(count) # NULL 포함
+        elif func == 'sum':
+            result.append(state if state is not None and column_type == 'int' else 0)
+        elif state is None:
+            result.append(None)
+        elif column_type == 'date': # max, min
+            result.append(format_date(state))
+        else:
+            result.append(state)
+    return tuple(result)
+
+def type_width(column_type):
+    """Number of characters of the longest value of a column type in the output."""
+    if column_type == 'int':
+        return len(str(-(1 << 63)))
+    if column_type == 'date':
+        return len('YYYY-MM-DD')
+    return int(column_type[5:-1])
+
+class ResultSink(ABC):
+    """Destination of the rows of a query result, chosen per session (SET OUTPUT TABLE | CSV | JSON).
+    rows are tuples of values (None is null, dates formatted), written while the plan produces them"""
+    # the prompt is printed before each statement (always on a terminal)
+    prompt = True
+    # set when the statement has written output, which a rerun after a deadlock would print twice (see run_statement)
+    written = False
+
+    @abstractmethod
+    def write(self, headers, column_types, rows, null_text="null"):
+        """write a result (an iterable of rows) with its column names and types"""
+
+class TableSink(ResultSink):
+    """Text table. the column widths come from the column types (an int has at most 20 characters, char(n) n,
+    a date 10), so no rows are held back to measure them and every line fits the columns of the header line"""
+    def write(self, headers, column_types, rows, null_text="null"):
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            width = sum(len(h) + 3 for h in headers) + 1
+            print("-" * width)
+            print("-" * width)
+            print("0 rows in set")
+            return
+
+        # 각 컬럼의 너비: 헤더, 타입의 최대 길이, 첫 row 중 큰 값 (sum은 타입보다 길어질 수 있고 결과 row가 하나)
+        column_widths = [max(len(h), type_width(column_type), len(null_text), len(str(value)))
+                         for h, column_type, value in zip(headers, column_types, first)]
+        width = sum(w + 3 for w in column_widths) + 1
+        line = (" " + " | ".join(f"{{:<{w}}}" for w in column_widths) + " \n").format
+
+        self.written = True
+        print("-" * width)
+        sys.stdout.write(line(*headers))
+        # the rows are formatted with one template and written RESULT_BUFFER_ROWS at a time
+        rows = itertools.chain([first], rows)
+        count = 0
+        for chunk in iter(lambda: list(itertools.islice(rows, RESULT_BUFFER_ROWS)), []):
+            sys.stdout.write("".join([line(*[null_text if value is None else value for value in row]) for row in chunk]))
+            count += len(chunk)
+        print("-" * width)
+        print(f"{count} row{'' if count == 1 else 's'} in set")
+
+class CsvSink(ResultSink):
+    """CSV, a header line then one line per row, null is \\N (an empty field is the empty string), the format read by LOAD DATA."""
+    prompt = False
+
+    def write(self, headers, column_types, rows, null_text="null"):
+        writer = csv.writer(sys.stdout, lineterminator="\n")
+        rows = iter(rows)
+        # the header is written with the first rows
+        chunk = list(itertools.islice(rows, RESULT_BUFFER_ROWS))
+        self.written = True
+        writer.writerow(headers)
+        while chunk:
+            writer.writerows([[CSV_NULL if value is None else value for value in row] for row in chunk])
+            chunk = list(itertools.islice(rows, RESULT_BUFFER_ROWS))
+
+class JsonLinesSink(ResultSink):
+    """JSON lines, one object {header: value} per row, ints are numbers, dates strings and null is null."""
+    prompt = False
+
+    def write(self, headers, column_types, rows, null_text="null"):
+        # the keys are encoded once, a line is the template filled with the encoded values (no dict per row)
+        encode_string = json.encoder.encode_basestring
+        line = "{" + ", ".join(f"{encode_string(h)}: %s" for h in headers) + "}\n"
+        rows = iter(rows)
+        for chunk in iter(lambda: list(itertools.islice(rows, RESULT_BUFFER_ROWS)), []):
+            self.written = True
+            sys.stdout.write("".join([line % tuple(["null" if value is None else encode_string(value) if value.__class__ is str else str(value)
+                                                    for value in row]) for row in chunk]))
+
+RESULT_SINKS = {"table": TableSink, "csv": CsvSink, "json": JsonLinesSink}
+
 class MyTransformer(Transformer):
     """Class that transforms the parsed SQL query into a database operation."""
+    def __init__(self):
+        super().__init__()
+        # metadata is read from the catalog, loaded once in main()
+        self.catalog = Catalog()
+        # where the rows of a select are written (SET OUTPUT)
+        self.result_sink = TableSink()
+
     # functions that starts with an underscore are helper functions
     # they access the database and perform the operations
     def _get_table_names(self):
         """Get the names of the tables in the database."""
-        table_names = []
-        cursor = myDB.cursor()
-        while True:
-            x = cursor.next()
-            if x is None:
-                break
-            key = x[0].decode()
-            if key.startswith('schema:'):
-                table_names.append(key.replace('schema:', ''))
-        return table_names
+        return self.catalog.table_names()
     
     def _get_table_metadata(self, table_name):
-        """Get the metadata of the table from the database."""
-        value = myDB.get(f'schema:{table_name}'.encode())
-        if value:
-            return json.loads(value.decode())
-        return None
+        """Get the metadata of the table (from the catalog)."""
+        return self.catalog.get_table(table_name)
+
+    def _row_key(self, table_name, rowid):
+        """Key of a single row (row:<table_name>:<rowid>), rowid is zero padded so that rows are sorted by rowid."""
+        return f'row:{table_name}:{rowid:016d}'.encode()
+
+    def _next_rowid(self, table_name, count=1):
+        """Allocate count new rowids for the table and return the first one (rowid:<table_name> keeps the next rowid)."""
+        value = myDB.get(f'rowid:{table_name}'.encode(), flags=db.DB_RMW)
+        rowid = int(value.decode()) if value else 0
+        myDB.put(f'rowid:{table_name}'.encode(), str(rowid + count).encode())
+        return rowid
+
+    def _get_primary_key(self, table_metadata):
+        """Primary key columns of the table (in column order)."""
+        return [column for column in table_metadata["columns"] if table_metadata["columns_metadata"][column]["primary_key"]]
+
+    def _primary_key_value(self, table_metadata, record):
+        """Encoded primary key of the record."""
+        primary_key = self._get_primary_key(table_metadata)
+        column_types = [table_metadata["columns_metadata"][column]["type"] for column in primary_key]
+        return encode_key([record[column] for column in primary_key], column_types)
+
+    def _new_row_key(self, table_name, table_metadata, record):
+        """Key of a new row, row:<table_name>:<encoded primary key> (btree keeps the rows in primary key order)
+        or row:<table_name>:<rowid> for a table without primary key."""
+        if not self._get_primary_key(table_metadata):
+            return self._row_key(table_name, self._next_rowid(table_name))
+        return f'row:{table_name}:'.encode() + self._primary_key_value(table_metadata, record)
+
+    def _scan_table(self, table_name):
+        """Iterate over the rows of the table with a cursor, yields (key, record) one by one."""
+        decode = self.catalog.row_codec(table_name).decode
+        for key, value in iter_prefix(f'row:{table_name}:'.encode()):
+            yield key, decode(value)
 
     def _get_table_data(self, table_name):
         """Get the data of the table from the database."""
-        value = myDB.get(f'data:{table_name}'.encode())
-        if value:
-            return json.loads(value.decode())
+        return [record for _, record in self._scan_table(table_name)]
+
+    def _table_records(self, table_name):
+        """All records of the table (row or columnar layout)."""
+        columnar_table = self._columnar_table(table_name)
+        if columnar_table is not None:
+            return list(columnar_table.rows())
+        return self._get_table_data(table_name)
+
+    def _table_statistics(self, table_name, flags=0):
+        """TableStatistics of the table (stats:<table_name>)."""
+        return TableStatistics.load(table_name, self._get_table_metadata(table_name), flags)
+
+    def _record_changes(self, table_name, inserted=(), deleted=()):
+        """Update the statistics of the table with the inserted/deleted records (one read and write of stats:<table_name>)."""
+        statistics = self._table_statistics(table_name, db.DB_RMW)
+        statistics.remove(deleted)
+        statistics.add(inserted)
+        statistics.save()
+
+    def _analyze_table(self, table_name):
+        """Compute the statistics of the table again from all its rows."""
+        statistics = TableStatistics(table_name, self._get_table_metadata(table_name))
+        statistics.rebuild(self._table_records(table_name))
+        statistics.save()
+
+    def _compared_columns(self, condition):
+        """(table_name, column_name) of the column operands of a where comparison, none for a null predicate.
+        a null value in one of them cannot be compared (IncomparableError for every row the condition is evaluated on)"""
+        if condition["type"] == "null predicate":
+            return []
+        operands = (condition["comp_operand_1"], condition["comp_operand_2"])
+        return [(operand.get("table_name", ""), operand["column_name"]) for operand in operands if operand.get("type") == "column_name"]
+
+    def _condition_selectivity(self, statistics, condition):
+        """Estimated fraction of the rows of a table satisfying one where condition on its columns."""
+        if condition["type"] == "null predicate":
+            selectivity = statistics.null_fraction(condition["column_name"])
+            if not condition["is_null"]:
+                selectivity = 1 - selectivity
+            return 1 - selectivity if condition["not"] else selectivity
+        comparison = self._column_literal_comparison(condition)
+        if comparison is None:
+            return DEFAULT_SELECTIVITY
+        column_name, comp_op, literal = comparison
+        return statistics.selectivity(column_name, comp_op, self._literal_value(literal))
+
+    def _estimate_rows(self, statistics, conditions):
+        """Estimated number of rows of a table satisfying all conditions (assumed independent)."""
+        rows = statistics.rows
+        for condition in conditions:
+            rows *= self._condition_selectivity(statistics, condition)
+        return rows
+
+    def _get_index_metadata(self, index_name):
+        """Get the metadata of the index (index:<index_name>) from the catalog."""
+        return self.catalog.get_index(index_name)
+
+    def _index_scan(self, index_name, comp_op, value):
+        """Iterate over the rows whose indexed column satisfies '<column> comp_op value' with a cursor on the index.
+        yields (key, record) like _scan_table, in the order of the indexed column"""
+        decode = self.catalog.row_codec(self._get_index_metadata(index_name)["table_name"]).decode
+        cursor = myDB.cursor(myIndexes[index_name])
+        try:
+            if comp_op == "=":
+                x = cursor.pget(value, db.DB_SET)
+                while x is not None:
+                    yield x[1], decode(x[2])
+                    x = cursor.pget(db.DB_NEXT_DUP)
+            elif comp_op in (">", ">="):
+                x = cursor.pget(value, db.DB_SET_RANGE)
+                while x is not None:
+                    if comp_op == ">=" or x[0] != value:
+                        yield x[1], decode(x[2])
+                    x = cursor.pget(db.DB_NEXT)
+            else: # "<", "<="
+                x = cursor.pget(db.DB_FIRST)
+                while x is not None and (x[0] < value or (comp_op == "<=" and x[0] == value)):
+                    yield x[1], decode(x[2])
+                    x = cursor.pget(db.DB_NEXT)
+        finally:
+            myTransactions.close_cursor(cursor)
+
+    def _primary_key_scan(self, table_name, comp_op, value):
+        """Iterate over the rows whose (first) primary key column satisfies '<column> comp_op value'.
+        value is the encoded column value, the rows are found by seeking the row cursor (set_range)"""
+        prefix = f'row:{table_name}:'.encode()
+        decode = self.catalog.row_codec(table_name).decode
+        cursor = myDB.cursor()
+        try:
+            if comp_op in ("=", ">", ">="):
+                x = cursor.set_range(prefix + value)
+                while x is not None and x[0].startswith(prefix):
+                    at_value = x[0].startswith(prefix + value)
+                    if comp_op == "=" and not at_value:
+                        break
+                    if comp_op != ">" or not at_value:
+                        yield x[0], decode(x[1])
+                    x = cursor.next()
+            else: # "<", "<="
+                x = cursor.set_range(prefix)
+                while x is not None and x[0].startswith(prefix):
+                    rest = x[0][len(prefix):]
+                    if not (rest < value or (comp_op == "<=" and rest.startswith(value))):
+                        break
+                    yield x[0], decode(x[1])
+                    x = cursor.next()
+        finally:
+            myTransactions.close_cursor(cursor)
+
+    def _endpoint_index(self, table_metadata, column_name):
+        """"PRIMARY" if the column is the first primary key column, the name of its index if it is indexed, else None
+        (the smallest/largest non-null value of the column is then the first/last entry of the btree)"""
+        if table_metadata.get("layout") == "columnar":
+            return None
+        primary_key = self._get_primary_key(table_metadata)
+        if primary_key and column_name == primary_key[0]:
+            return "PRIMARY"
+        for index_name, indexed_column in table_metadata.get("indexes", {}).items():
+            if indexed_column == column_name:
+                return index_name
         return None
 
-    def _create_table(self, table_name, column_definition, primary_key, foreign_key):
+    def _column_endpoint(self, table_name, column_name, last):
+        """Smallest (largest if last) non-null value of a column having an _endpoint_index, read from one btree entry.
+        null values are not in the index and a primary key column is never null"""
+        decode = self.catalog.row_codec(table_name).decode
+        index_name = self._endpoint_index(self._get_table_metadata(table_name), column_name)
+        if index_name == "PRIMARY":
+            prefix = f'row:{table_name}:'.encode()
+            cursor = myDB.cursor()
+            try:
+                if last:
+                    # ';' follows ':', so the first key after the table's rows
+                    x = cursor.set_range(f'row:{table_name};'.encode())
+                    x = cursor.prev() if x is not None else cursor.last()
+                else:
+                    x = cursor.set_range(prefix)
+            finally:
+                myTransactions.close_cursor(cursor)
+            if x is None or not x[0].startswith(prefix):
+                return None
+            return decode(x[1])[column_name]
+
+        cursor = myDB.cursor(myIndexes[index_name])
+        try:
+            x = cursor.pget(db.DB_LAST if last else db.DB_FIRST)
+        finally:
+            myTransactions.close_cursor(cursor)
+        return None if x is None else decode(x[2])[column_name]
+
+    def _find_index_access(self, table_metadata, conditions, statistics):
+        """Choose an access path for a list of conditions that are all applied to the table (AND).
+        returns ("primary key" | "index", index_name, comp_op, encoded value, description) for '<column> comp_op <literal>'
+        on the first primary key column or an indexed column, or None (full scan)
+        no index is used if a compared column has null values: an index has no entries for them,
+        and only a full scan compares them (IncomparableError) like the conditions evaluated on every row.
+        the null counts of the statistics are exact, so every path left gives the same rows and the estimates
+        (which ANALYZE changes) only choose the cheapest: the condition with the fewest estimated rows,
+        and a secondary index only if it reads at most INDEX_SCAN_SELECTIVITY of the rows (each row found through it is a lookup in myDB)"""
+        if table_metadata.get("layout") == "columnar":
+            return None
+        if any(statistics.has_nulls(column_name) for condition in conditions for _, column_name in self._compared_columns(condition)):
+            return None
+        index_columns = {column: index_name for index_name, column in table_metadata.get("indexes", {}).items()}
+        primary_key = self._get_primary_key(table_metadata)
+        access = None
+        best_rank = None
+        for condition in conditions:
+            comparison = self._column_literal_comparison(condition)
+            if comparison is None:
+                continue
+            column_name, comp_op, literal = comparison
+            if comp_op == "!=":
+                continue
+
+            column_type = table_metadata["columns_metadata"][column_name]["type"]
+            description = f"{column_name} {comp_op} {literal['value']}"
+            value = self._literal_value(literal)
+            # rank: fewer estimated rows, primary key before secondary index
+            order = statistics.selectivity(column_name, comp_op, value)
+            if primary_key and column_name == primary_key[0]:
+                if not fits_index_key(value, column_type):
+                    # no key to seek to (the same for an index), the scan compares the literal with every row
+                    continue
+                rank = (order, 0)
+                candidate = ("primary key", "PRIMARY", comp_op, encode_key([value], [column_type]), description)
+            elif column_name in index_columns:
+                if order > INDEX_SCAN_SELECTIVITY or not fits_index_key(value, column_type):
+                    continue
+                rank = (order, 1)
+                candidate = ("index", index_columns[column_name], comp_op, encode_index_value(value, column_type), description)
+            else:
+                continue
+            if best_rank is None or rank < best_rank:
+                access, best_rank = candidate, rank
+        return access
+
+    def _column_literal_comparison(self, condition):
+        """(column_name, comp_op, literal operand) of a '<column> comp_op <literal>' condition, None for other conditions.
+        the operands are swapped to put the column first and NOT is applied to comp_op"""
+        if condition["type"] != "comparison":
+            return None
+        comp_op = condition["comp_op"]
+        operand1 = condition["comp_operand_1"]
+        operand2 = condition["comp_operand_2"]
+        if operand1.get("type") == "column_name" and operand2.get("type") != "column_name":
+            column, literal = operand1, operand2
+        elif operand2.get("type") == "column_name" and operand1.get("type") != "column_name":
+            column, literal = operand2, operand1
+            comp_op = FLIPPED_COMP_OPS[comp_op]
+        else:
+            return None
+        if condition["not"]:
+            comp_op = NEGATED_COMP_OPS[comp_op]
+        return column["column_name"], comp_op, literal
+
+    def _columnar_table(self, table_name):
+        """ColumnarTable of a table created with USING COLUMNAR, None for the row layout."""
+        table_metadata = self._get_table_metadata(table_name)
+        if table_metadata is None or table_metadata.get("layout") != "columnar":
+            return None
+        return ColumnarTable(table_name, table_metadata)
+
+    def _columnar_filters(self, conditions):
+        """filters [(column, comp_op, value), ...] of the conditions that a columnar scan evaluates on the columns
+        ('<column> comp_op <literal>', conditions of one table combined with AND)"""
+        filters = []
+        for condition in conditions:
+            comparison = self._column_literal_comparison(condition)
+            if comparison is not None:
+                column_name, comp_op, literal = comparison
+                filters.append((column_name, comp_op, self._literal_value(literal)))
+        return filters
+
+    def _scan_access(self, table_name, access):
+        """Iterate over the rows of the table with a full scan (access is None), the primary key or an index."""
+        if access is None:
+            return self._scan_table(table_name)
+        access_type, index_name, comp_op, value, _ = access
+        if access_type == "primary key":
+            return self._primary_key_scan(table_name, comp_op, value)
+        return self._index_scan(index_name, comp_op, value)
+
+    def _create_index(self, index_name, table_name, column_name):
+        """helper function of create_index_query"""
+        table_metadata = self._get_table_metadata(table_name)
+        if table_metadata is None:
+            Messages.NoSuchTable("Create index")
+            raise QueryError
+        if self._get_index_metadata(index_name) is not None:
+            Messages.IndexExistenceError()
+            raise QueryError
+        if column_name not in table_metadata["columns_metadata"]:
+            Messages.IndexColumnExistenceError(column_name)
+            raise QueryError
+        if table_metadata.get("layout") == "columnar":
+            # the indexes are associated with the row keys
+            Messages.IndexColumnarTableError()
+            raise QueryError
+
+        # build the index from the existing rows
+        column_type = table_metadata["columns_metadata"][column_name]["type"]
+        open_index(index_name, table_name, column_name, self.catalog.row_codec(table_name), column_type, create=True)
+
+        table_metadata.setdefault("indexes", {})[index_name] = column_name
+        self.catalog.put_table(table_name, table_metadata)
+        self.catalog.put_index(index_name, {"table_name": table_name, "column_name": column_name})
+        Messages.CreateIndexSuccess(index_name)
+
+    def _remove_index(self, index_name):
+        """Delete the index file and the index metadata."""
+        index_metadata = self._get_index_metadata(index_name)
+        close_index(index_name, remove=True)
+        table_metadata = self._get_table_metadata(index_metadata["table_name"])
+        table_metadata["indexes"].pop(index_name)
+        self.catalog.put_table(index_metadata["table_name"], table_metadata)
+        self.catalog.delete_index(index_name)
+
+    def _drop_index(self, index_name):
+        """helper function of drop_index_query"""
+        if self._get_index_metadata(index_name) is None:
+            Messages.NoSuchIndex()
+            raise QueryError
+        self._remove_index(index_name)
+        Messages.DropIndexSuccess(index_name)
+
+    def _create_table(self, table_name, column_definition, primary_key, foreign_key, layout="row"):
         """helper function of create_table_query"""
         # check if table with the same name already exists
         table_names = self._get_table_names()
@@ -199,12 +2034,17 @@ class MyTransformer(Transformer):
                     Messages.ReferenceTypeError()
                     raise QueryError
 
+            # the foreign keys are checked with the row keys of the referenced table and an index of the referencing rows
+            if layout == "columnar" or self._get_table_metadata(ref_table_name).get("layout") == "columnar":
+                Messages.ReferenceColumnarTableError()
+                raise QueryError
+
         # no error, add table relation to the db
         for fkey in foreign_key:
             data = {}
             for col_curr, col_ref in zip(fkey['column_list'], fkey['ref_column_list']):
                 data[col_curr] = col_ref
-            myDB.put(f'reference:{table_name}:{fkey["ref_table_name"]}'.encode(), json.dumps(data).encode())
+            self.catalog.put_reference(table_name, fkey["ref_table_name"], data)
         
         # create table metadata
         # column의 순서도 저장할 필요가 있음 (insert 시 순서대로 저장되어야 함)
@@ -226,37 +2066,76 @@ class MyTransformer(Transformer):
             for column in fkey['column_list']:
                 metadata[column]['foreign_key'] = True
         schema_metadata["columns_metadata"] = metadata
+        # index_name -> column_name
+        schema_metadata["indexes"] = {}
+        # row (row:<table_name>:<key>) or columnar (col:<table_name>:<column_name>:<segment>)
+        schema_metadata["layout"] = layout
     
-        # put the metadata into the database
-        myDB.put(f'schema:{table_name}'.encode(), json.dumps(schema_metadata).encode())
-        # put the empty data into the database
-        myDB.put(f'data:{table_name}'.encode(), json.dumps([]).encode())
+        # put the metadata into the database (rows are added later under row:<table_name>:<rowid>)
+        self.catalog.put_table(table_name, schema_metadata)
+        TableStatistics(table_name, schema_metadata).save()
+
+        # the foreign key indexes are associated with the (empty) table
+        for fkey in foreign_key:
+            columns, column_types = self._reference_columns(table_name, fkey["ref_table_name"])
+            open_reference_index(table_name, fkey["ref_table_name"], columns, column_types, self.catalog.row_codec(table_name), create=True)
 
         Messages.CreateTableSuccess(table_name)
 
     def _referenced_by_another_table(self, table_name):
-        """Check if the table is referenced by any other table."""
-        cursor = myDB.cursor()
-        while True:
-            x = cursor.next()
-            if x is None:
-                break
-            key = x[0].decode()
-            if key.startswith('reference:'):
-                if key.split(':')[-1] == table_name:
-                    return True
+        """Check if the table is referenced by any other table (seek to referenced_by:<table_name>:)."""
+        for _ in iter_prefix(f'referenced_by:{table_name}:'.encode()):
+            return True
         return False
 
     def _delete_table_relation(self, table_name):
-        """Delete the table relation from the database."""
-        cursor = myDB.cursor()
-        while True:
-            x = cursor.next()
-            if x is None:
-                break
-            key = x[0].decode()
-            if key.startswith(f'reference:{table_name}:'):
-                myDB.delete(x[0])
+        """Delete the table relation from the database (reference:<table_name>:<referenced table_name> keys)."""
+        keys = [key for key, _ in iter_prefix(f'reference:{table_name}:'.encode())]
+        for key in keys:
+            reference = key.decode().split(':')[1:]
+            if tuple(reference) in myReferenceIndexes:
+                close_reference_index(*reference, remove=True)
+            self.catalog.delete_reference(*reference)
+
+    def _reference_columns(self, table_name, ref_table_name):
+        """(columns of table_name, column types) of its foreign key to ref_table_name, in the primary key order of ref_table_name
+        the encoded values of the columns are the primary key part of the referenced row key"""
+        columns = self.catalog.references[(table_name, ref_table_name)]
+        ref_table_metadata = self._get_table_metadata(ref_table_name)
+        ref_columns = {ref_column: column for column, ref_column in columns.items()}
+        primary_key = self._get_primary_key(ref_table_metadata)
+        column_types = [ref_table_metadata["columns_metadata"][column]["type"] for column in primary_key]
+        return [ref_columns[column] for column in primary_key], column_types
+
+    def _referenced_rows_exist(self, table_name, records):
+        """True if every foreign key of the records references an existing row, one get of the referenced row key per foreign key
+        (a foreign key with a null value references nothing)"""
+        for child_table_name, ref_table_name in self.catalog.references:
+            if child_table_name != table_name:
+                continue
+            columns, column_types = self._reference_columns(table_name, ref_table_name)
+            prefix = f'row:{ref_table_name}:'.encode()
+            for record in records:
+                values = [record[column] for column in columns]
+                if any(value is None for value in values):
+                    continue
+                if myDB.get(prefix + encode_key(values, column_types)) is None:
+                    return False
+        return True
+
+    def _is_referenced(self, table_name, key):
+        """True if a row of another table references the row (key), one seek in the foreign key index of each referencing table."""
+        primary_key_value = key[len(f'row:{table_name}:'):]
+        for child_table_name, ref_table_name in self.catalog.references:
+            if ref_table_name != table_name:
+                continue
+            cursor = myDB.cursor(myReferenceIndexes[(child_table_name, ref_table_name)])
+            try:
+                if cursor.set(primary_key_value) is not None:
+                    return True
+            finally:
+                myTransactions.close_cursor(cursor)
+        return False
 
     def _drop_table(self, table_name):
         """helper function of drop_table_query"""
@@ -270,11 +2149,19 @@ class MyTransformer(Transformer):
             Messages.DropReferencedTableError(table_name)
             raise QueryError
 
-        # delete the table relation from the db
+        # delete the table relation and the indexes of the table from the db
         self._delete_table_relation(table_name)
+        for index_name in list(self._get_table_metadata(table_name).get("indexes", {})):
+            self._remove_index(index_name)
         # delete the table metadata and data from the db
-        myDB.delete(f'schema:{table_name}'.encode())
-        myDB.delete(f'data:{table_name}'.encode())
+        columnar_table = self._columnar_table(table_name)
+        if columnar_table is not None:
+            columnar_table.drop()
+        self.catalog.delete_table(table_name)
+        self._delete_all_rows(table_name)
+        if myDB.get(f'rowid:{table_name}'.encode()) is not None:
+            myDB.delete(f'rowid:{table_name}'.encode())
+        TableStatistics.drop(table_name)
 
         # print the success message
         Messages.DropSuccess(table_name)
@@ -322,9 +2209,10 @@ class MyTransformer(Transformer):
         # print the number of rows in the table (singular/plural distinction)
         print(f'{len(table_names)} row{"s" if len(table_names) != 1 else ""} in set')
 
-    def _select_query(self, select_column_list, select_table_list, select_join_table_list, select_condition_list, select_order_by_list):
-        """helper function of select_query"""
-        # get all tables' data and metadata (in select_table_list and select_join_table_list)
+    def _select_query(self, select_column_list, select_table_list, select_join_table_list, select_condition_list, select_order_by_list, select_limit=None, explain=None):
+        """helper function of select_query and explain_select_query
+        explain: None (print the result), "plan" (print the operator tree) or "analyze" (run it, print the tree with rows and times)"""
+        # get all tables' metadata (in select_table_list and select_join_table_list), data is scanned in join_tables
         tables_info = {}
         for table in select_table_list:
             table_name = table['table_name']
@@ -337,7 +2225,6 @@ class MyTransformer(Transformer):
             
             tables_info[alias] = {
                 'original_name': table_name,
-                'data': self._get_table_data(table_name),
                 'metadata': metadata,
             }
         for join in select_join_table_list:
@@ -351,7 +2238,6 @@ class MyTransformer(Transformer):
 
             tables_info[table_name] = {
                 'original_name': table_name,
-                'data': self._get_table_data(table_name),
                 'metadata': metadata,
             }
 
@@ -437,190 +2323,249 @@ class MyTransformer(Transformer):
             
             return parsed_conditions
         
-        def apply_joins(records):
-            """apply the joins to the records"""
-            # check the join conditions and return the parsed conditions
-            parsed_conditions = check_join_conditions()
-
-            for condition in parsed_conditions:
-                records = [r for r in records if r[f"{condition['table1']}.{condition['column1']}"] == r[f"{condition['table2']}.{condition['column2']}"]]
-            
-            return records
-        
-        def generate_cartesian_product():
-            """cartesian product of tables in from clause"""
-            result = [{}]
+        def plan_joins(join_conditions, table_predicates, join_predicates):
+            """build the operator tree combining the tables in from/join clauses
+            each table is scanned with its pushed down where conditions (an index of the table is used when one of them
+            compares an indexed column with a value), then the tables are joined in the order with the fewest estimated
+            intermediate rows (order_joins). tables connected by a join condition or a where equi-join are hash joined
+            with the hash table built on the smaller side, cartesian product only between unrelated tables,
+            the other where conditions on several tables filter the first join containing all their tables"""
+            aliases = list(tables_info)
+            position = {alias: i for i, alias in enumerate(aliases)}
+            table_plans = []
+            sizes = []
+            distinct = []
             for alias, info in tables_info.items():
-                new_result = []
-                for record in result:
-                    # for each record in the result, add a new record for each record in the table
-                    for table_record in info['data']:
-                        new_record = record.copy()
-                        for col, val in table_record.items():
-                            new_record[f"{alias}.{col}"] = val
-                        new_result.append(new_record)
-                result = new_result
-
-            return result
-
-        def validate_condition(condition):
-            """validate the condition"""
-            def get_type(operand):
-                if operand.get("type") == "column_name":
-                    table = resolve_column_reference(operand["column_name"], operand.get("table_name", ""), "WHERE")
-                    type_ = tables_info[table]['metadata']['columns_metadata'][operand['column_name']]['type']
-                else: # comparable_value
-                    type_ = operand["value_type"]
-
-                if type_ == "str" or type_.startswith("char"):
-                    type_ = "char"
-                
-                return type_
-            
+                predicate, conditions, description = table_predicates.get(alias, (None, [], ""))
+                statistics = self._table_statistics(info['original_name'])
+                columnar_table = self._columnar_table(info['original_name'])
+                if columnar_table is not None:
+                    # comparisons with a value are evaluated on the columns before the rows are built
+                    filters = self._columnar_filters(conditions)
+                    table_plan = ColumnarScan(columnar_table, alias, filters)
+                    if conditions and len(filters) == len(conditions):
+                        predicate = None
+                else:
+                    access = self._find_index_access(info['metadata'], conditions, statistics)
+                    table_plan = TableScan(self, info['original_name'], alias, info['metadata']['columns'], access)
+                table_plan.estimated_rows = statistics.rows
+                size = statistics.rows
+                if predicate:
+                    table_plan = Filter(table_plan, predicate, description)
+                    # an OR pushed down as a whole has no conditions to estimate
+                    table_plan.estimated_rows = self._estimate_rows(statistics, conditions) if conditions else None
+                    size = table_plan.estimated_rows if conditions else size * DEFAULT_SELECTIVITY
+
+                # join conditions with both columns in this table filter it before joining
+                for condition in join_conditions:
+                    if condition['table1'] == condition['table2'] == alias:
+                        key1 = f"{alias}.{condition['column1']}"
+                        key2 = f"{alias}.{condition['column2']}"
+                        table_plan = Filter(table_plan, lambda r, key1=key1, key2=key2: r[key1] == r[key2], f"{key1} = {key2}")
+                        size *= DEFAULT_SELECTIVITY
+                        table_plan.estimated_rows = size
+                table_plans.append(table_plan)
+                sizes.append(size)
+                # distinct values of a join column after the table is filtered
+                distinct.append(lambda column, statistics=statistics, size=size: max(1, min(statistics.distinct(column), size)))
+
+            # equi-join keys (table i, table j, key in i, key in j, strict) and the other conditions ({tables}, predicate, description)
+            join_keys = []
+            for condition in join_conditions:
+                if condition['table1'] != condition['table2']:
+                    join_keys.append((position[condition['table1']], position[condition['table2']],
+                                      condition['column1'], condition['column2'], False))
+            filters = []
+            for tables, predicate, description, condition in join_predicates:
+                columns = equi_join_columns(condition)
+                if columns:
+                    (alias1, column1), (alias2, column2) = columns
+                    # a where comparison cannot compare null values (error instead of no match)
+                    join_keys.append((position[alias1], position[alias2], column1, column2, True))
+                else:
+                    filters.append(({position[alias] for alias in tables}, predicate, description))
+
+            edges = [(i, j, 1 / max(distinct[i](column_i), distinct[j](column_j))) for i, j, column_i, column_j, _ in join_keys]
+            tree, rows = order_joins(sizes, edges, [(tables, DEFAULT_SELECTIVITY) for tables, _, _ in filters if len(tables) > 1])
+            placed = set()
+
+            def build(tree):
+                """operator tree of a join tree from order_joins, returns (plan, bit mask of its tables)"""
+                if isinstance(tree, int):
+                    return table_plans[tree], 1 << tree
+                left, left_mask = build(tree[0])
+                right, right_mask = build(tree[1])
+                if rows[right_mask] > rows[left_mask]:
+                    # the right side is kept in memory (hash table / inner table of the cartesian product)
+                    left, left_mask, right, right_mask = right, right_mask, left, left_mask
+                mask = left_mask | right_mask
+
+                key_pairs = []
+                strict_keys = []
+                for i, j, column_i, column_j, strict in join_keys:
+                    key_i = f"{aliases[i]}.{column_i}"
+                    key_j = f"{aliases[j]}.{column_j}"
+                    if left_mask >> i & 1 and right_mask >> j & 1:
+                        key_pairs.append((key_i, key_j))
+                    elif left_mask >> j & 1 and right_mask >> i & 1:
+                        key_pairs.append((key_j, key_i))
+                    else:
+                        continue
+                    if strict:
+                        strict_keys.append(len(key_pairs) - 1)
+                plan = HashJoin(left, right, key_pairs, strict_keys) if key_pairs else NestedLoopJoin(left, right)
+
+                estimated_rows = rows[mask]
+                applied = []
+                for number, (tables, predicate, description) in enumerate(filters):
+                    if number not in placed and len(tables) > 1 and all(mask >> i & 1 for i in tables):
+                        placed.add(number)
+                        applied.append((predicate, description))
+                        estimated_rows /= DEFAULT_SELECTIVITY
+                plan.estimated_rows = estimated_rows
+                for predicate, description in applied:
+                    plan = Filter(plan, predicate, description)
+                    plan.estimated_rows = rows[mask]
+                return plan, mask
+
+            plan, _ = build(tree)
+            # conditions without columns are checked on the joined rows
+            for number, (_, predicate, description) in enumerate(filters):
+                if number not in placed:
+                    plan = Filter(plan, predicate, description)
+            return plan
+
+        def equi_join_columns(condition):
+            """((alias, column), (alias, column)) if the where condition is '<column> = <column>' of two tables, else None"""
+            if condition is None or condition["type"] == "null predicate" or condition["not"] or condition["comp_op"] != "=":
+                return None
+            columns = []
+            for operand in (condition["comp_operand_1"], condition["comp_operand_2"]):
+                if operand.get("type") != "column_name":
+                    return None
+                columns.append((resolve_column_reference(operand["column_name"], operand.get("table_name", ""), "WHERE"), operand["column_name"]))
+            if columns[0][0] == columns[1][0]:
+                return None
+            return tuple(columns)
+
+        def resolve_where_column(table_name, column_name):
+            """resolver of the predicate compiler, where clause column -> (record key, column type)"""
+            alias = resolve_column_reference(column_name, table_name, "WHERE")
+            return f"{alias}.{column_name}", tables_info[alias]['metadata']['columns_metadata'][column_name]['type']
+
+        def condition_tables(condition):
+            """aliases of the tables referenced by the condition"""
             if condition["type"] == "null predicate":
-                # if null predicate, check if the column is null
-                resolve_column_reference(
-                    condition["column_name"],
-                    condition.get("table_name", ""),
-                    "WHERE",
-                )
-                return
-            
-            # if comparison type, check if the condition is met
-            operand1 = condition["comp_operand_1"]
-            operand2 = condition["comp_operand_2"]
-
-            type1 = get_type(operand1)
-            type2 = get_type(operand2)
-
-            # type check
-            if type1 != type2:
-                Messages.IncomparableError()
-                raise QueryError
-            
-            # char type cannot be compared with other operators
-            if type1 == type2 == "char" and condition["comp_op"] not in ["=", "!="]:
-                Messages.IncomparableError()
-                raise QueryError
-
-        def check_condition(record, condition):
-            """check if the record matches the condition in where clause"""
-            def get_value(operand):
+                return {resolve_column_reference(condition["column_name"], condition.get("table_name", ""), "WHERE")}
+            tables = set()
+            for operand in (condition["comp_operand_1"], condition["comp_operand_2"]):
                 if operand.get("type") == "column_name":
-                    table = resolve_column_reference(operand["column_name"], operand.get("table_name", ""), "WHERE")
-                    value = record[f"{table}.{operand['column_name']}"]
-                    type_ = tables_info[table]['metadata']['columns_metadata'][operand['column_name']]['type']
-                else: # comparable_value
-                    value = operand["value"]
-                    type_ = operand["value_type"]
-                    if type_ == "int":
-                        value = int(value)
-                    elif type_ == "str":
-                        value = value[1:][:-1]
-
-                if type_ == "date" and value is not None:
-                    value = datetime.strptime(value, "%Y-%m-%d")
-                
-                return value
-            
-            if condition["type"] == "null predicate":
-                # if null predicate, check if the column is null
-                table = resolve_column_reference(
-                    condition["column_name"],
-                    condition.get("table_name", ""),
-                    "WHERE",
-                )
-                value = record[f"{table}.{condition['column_name']}"]
-                is_null = value is None
-                result = (is_null == condition["is_null"])
-                return not result if condition["not"] else result
-            
-            # if comparison type, check if the condition is met
-            operand1 = condition["comp_operand_1"]
-            operand2 = condition["comp_operand_2"]
-
-            value1 = get_value(operand1)
-            value2 = get_value(operand2)
-
-            # cannot compare null value
-            if value1 is None or value2 is None:
-                Messages.IncomparableError()
-                raise QueryError
-            
-            # comparison operation
-            comp_ops = {
-                "=": lambda x, y: x == y,
-                "!=": lambda x, y: x != y,
-                ">": lambda x, y: x > y,
-                ">=": lambda x, y: x >= y,
-                "<": lambda x, y: x < y,
-                "<=": lambda x, y: x <= y,
-            }
-            result = comp_ops[condition["comp_op"]](value1, value2)
-            return not result if condition["not"] else result
-
-        def apply_conditions(records):
-            """apply where conditions to the records"""
+                    tables.add(resolve_column_reference(operand["column_name"], operand.get("table_name", ""), "WHERE"))
+            return tables
+
+        def compares_nulls():
+            """True if a where comparison uses a column that has null values (the null counts of the statistics are exact)"""
+            statistics = {}
+            for condition in select_condition_list[1:]:
+                for table_name, column_name in self._compared_columns(condition):
+                    alias = resolve_column_reference(column_name, table_name, "WHERE")
+                    if alias not in statistics:
+                        statistics[alias] = self._table_statistics(tables_info[alias]['original_name'])
+                    if statistics[alias].has_nulls(column_name):
+                        return True
+            return False
+
+        def plan_conditions():
+            """validate/compile the where conditions and push the ones touching only one table down to that table
+            returns ({alias: (predicate, [conditions], description)}, [({aliases}, predicate, description, condition), ...])
+            the conditions of a table are used to choose an index for its scan (empty when pushed down as OR),
+            the others are placed by plan_joins (condition is None for an OR of several tables, or for the whole where clause
+            when a compared column has null values)"""
             if not select_condition_list:
-                return records
+                return {}, []
             
             # 조건 먼저 검증 (records가 비어있어도 조건 검증 반드시 이루어짐)
-            if select_condition_list[0] == "SINGLE":
-                validate_condition(select_condition_list[1])
-            else: # AND / OR
-                validate_condition(select_condition_list[1])
-                validate_condition(select_condition_list[2])
-
-            filtered_records = []
-            for record in records:
-                if select_condition_list[0] == "SINGLE":
-                    if check_condition(record, select_condition_list[1]):
-                        filtered_records.append(record)
-                else: # AND / OR
-                    result1 = check_condition(record, select_condition_list[1])
-                    result2 = check_condition(record, select_condition_list[2])
-                    if select_condition_list[0] == "AND" and (result1 and result2):
-                        filtered_records.append(record)
-                    elif select_condition_list[0] == "OR" and (result1 or result2):
-                        filtered_records.append(record)
-            
-            return filtered_records
-        
-        def sort_orders(records):
-            """sort the records by the order by clause"""
-            if not select_order_by_list:
-                return records
-
-            for order in reversed(select_order_by_list):
+            predicates = []
+            for condition in select_condition_list[1:]:
+                predicate = self._compile_condition(condition, resolve_where_column)
+                predicates.append((condition_tables(condition), predicate, condition))
+
+            if compares_nulls():
+                # a comparison with a null value raises the error for every row it is evaluated on, so the where clause
+                # is evaluated on the joined rows as a whole (a table filtered before the join could hide or drop such rows)
+                predicate = self._combine_predicates(select_condition_list[0], [p for _, p, _ in predicates])
+                description = f" {select_condition_list[0].lower()} ".join(self._condition_text(c) for _, _, c in predicates)
+                return {}, [(set(tables_info), predicate, description, None)]
+
+            table_predicates = {}
+            if select_condition_list[0] == "OR":
+                # OR can be pushed down only as a whole
+                tables = predicates[0][0] | predicates[1][0]
+                predicate = self._combine_predicates("OR", [p for _, p, _ in predicates])
+                description = " or ".join(self._condition_text(c) for _, _, c in predicates)
+                if len(tables) == 1:
+                    table_predicates[tables.pop()] = (predicate, [], description)
+                    return table_predicates, []
+                return table_predicates, [(tables, predicate, description, None)]
+
+            # SINGLE / AND: each condition is pushed down separately
+            join_predicates = []
+            for tables, predicate, condition in predicates:
+                if len(tables) == 1:
+                    alias = tables.pop()
+                    if alias in table_predicates:
+                        previous, conditions, description = table_predicates[alias]
+                        predicate = self._combine_predicates("AND", [previous, predicate])
+                        table_predicates[alias] = (predicate, conditions + [condition], f"{description} and {self._condition_text(condition)}")
+                    else:
+                        table_predicates[alias] = (predicate, [condition], self._condition_text(condition))
+                else:
+                    join_predicates.append((tables, predicate, self._condition_text(condition), condition))
+            return table_predicates, join_predicates
+
+        def plan_columnar_aggregate(table_predicates, join_predicates, outputs):
+            """aggregate over the columns of a single columnar table, None if the query needs the rows
+            (join, or where conditions other than comparisons of a column with a value)"""
+            if len(tables_info) != 1 or join_predicates:
+                return None
+            alias, info = next(iter(tables_info.items()))
+            columnar_table = self._columnar_table(info['original_name'])
+            if columnar_table is None:
+                return None
+            predicate, conditions, _ = table_predicates.get(alias, (None, [], ""))
+            filters = self._columnar_filters(conditions)
+            if predicate is not None and (not conditions or len(filters) != len(conditions)):
+                return None
+            # row key <alias>.<column> -> column
+            aggregates = [(func, key and key[len(alias) + 1:], column_type) for func, key, column_type in outputs]
+            return ColumnarAggregate(columnar_table, aggregates, filters)
+
+        def plan_metadata_aggregate(outputs):
+            """aggregate answered from the table statistics and index endpoints without reading the rows,
+            None if the query needs the rows (where/join conditions, sum, min/max of a column without index)"""
+            if select_condition_list or select_join_table_list:
+                return None
+            for func, key, _ in outputs:
+                if func in ('count(*)', 'count'):
+                    continue
+                if func not in ('max', 'min'):
+                    return None
+                alias, column_name = key.split('.', 1)
+                if self._endpoint_index(tables_info[alias]['metadata'], column_name) is None:
+                    return None
+            return MetadataAggregate(self, {alias: info['original_name'] for alias, info in tables_info.items()}, outputs)
+
+        def plan_sort():
+            """resolve the order by clause into sort keys [(row key, descending), ...]"""
+            sort_keys = []
+            for order in select_order_by_list:
                 column_name = order['column_name']
                 table_name = resolve_column_reference(column_name, order['table_name'], "ORDER BY")
-                reverse = order['direction'].lower() == 'desc'
-
-                column_type = tables_info[table_name]['metadata']['columns_metadata'][column_name]['type']
-
-                def get_sort_key(record):
-                    value = record[f"{table_name}.{column_name}"]
-                    # When doing an ORDER BY, NULL values are presented first if you do ORDER BY ... ASC and last if you do ORDER BY ... DESC.
-                    # smallest 한 값으로 처리
-                    if value is None:
-                        return (0, None)
-
-                    # type별로 다르게 처리
-                    if column_type == 'int':
-                        return (1, int(value))
-                    elif column_type == 'char':
-                        return (1, value)
-                    elif column_type == 'date':
-                        return (1, datetime.strptime(value, "%Y-%m-%d"))
-                    else:
-                        return (1, value)
-                
-                records.sort(key=get_sort_key, reverse=reverse)
-                
-            return records
+                sort_keys.append((f"{table_name}.{column_name}", order['direction'].lower() == 'desc'))
+            return sort_keys
 
-        def format_output(records):
-            """format and print the query result"""            
+        def plan_output():
+            """resolve the select list, returns (headers, is_aggregate, row keys or aggregate specs)"""
             # select * 인 경우 모든 columns 선택
             if not select_column_list:
                 all_columns = []
@@ -637,126 +2582,100 @@ class MyTransformer(Transformer):
                 columns_to_process = select_column_list
             
             has_aggregate = any(col['type'] in ['aggregate', 'total_count'] for col in columns_to_process)
-            has_normal = any(col['type'] == 'column' for col in columns_to_process)
+            normal_columns = [col['column_name'] for col in columns_to_process if col['type'] == 'column']
 
-            if has_aggregate and has_normal:
+            if has_aggregate and normal_columns:
                 # group by가 없으므로 aggregate/total_count 타입은 column 이랑 같이 쓰이면 안됨
-                Messages.SelectColumnNotGrouped()
+                Messages.SelectColumnNotGrouped(normal_columns[0])
                 raise QueryError
             
-            if has_aggregate:
-                headers = []
-                values = []
-
-                for col in columns_to_process:
-                    if col['type'] == 'total_count':
-                        headers.append('count(*)' if col['alias'] == '' else col['alias'])
-                        values.append(str(len(records)))
-                    else: # aggregate
-                        func = col['aggregate_func']
-                        col_name = col['column_name']
-                        table = col['table_name'] or resolve_column_reference(col_name, None, "SELECT")
-                        header = col['alias'] or f"{func}({table}.{col_name})"
-                        headers.append(header)
-
-                        # 값들을 뽑아옵니다
-                        column_type = tables_info[table]['metadata']['columns_metadata'][col_name]['type']
-                        column_values = [r[f"{table}.{col_name}"] for r in records]
-
-                        if func == 'count':
-                            values.append(str(len(column_values))) # NULL 포함
-                        else:
-                            non_null_values = [v for v in column_values if v is not None]
-                            if not non_null_values:
-                                if func == 'sum':
-                                    values.append('0')
-                                else:
-                                    values.append('NULL')
-                                continue
-                                
-                            if func == 'sum':
-                                if column_type != 'int':
-                                    values.append('0')
-                                else:
-                                    values.append(str(sum(non_null_values)))
-                            elif func in ['max', 'min']:
-                                if column_type == 'date':
-                                    processed_values = [datetime.strptime(v, "%Y-%m-%d") for v in non_null_values]
-                                else:
-                                    processed_values = non_null_values
-                                
-                                result_value = str(max(processed_values) if func == 'max' else min(processed_values))
-                                if column_type == 'date':
-                                    result_value = result_value.strftime("%Y-%m-%d")
-                                
-                                values.append(result_value)
-
-                column_widths = [max(len(h), len(str(v))) for h, v in zip(headers, values)]
-                width = sum(w + 3 for w in column_widths) + 1
-                
-                print("-" * width)
-                print(" " + " | ".join(f"{h:<{w}}" for h, w in zip(headers, column_widths)) + " ")
-                print(" " + " | ".join(f"{v:<{w}}" for v, w in zip(values, column_widths)) + " ")
-                print("-" * width)
-                print("1 row in set")
-            else:
-                # 일반적인 경우 (column 타입만 있는 경우)
-                headers = []
-                for col in columns_to_process:
-                    table = col['table_name'] or resolve_column_reference(col['column_name'], None, "SELECT")
-                    header = col['alias'] or f"{table}.{col['column_name']}"
-                    headers.append({
-                        'display': header,
-                        'key': f"{table}.{col['column_name']}"
-                    })
-                
-                if not records:
-                    width = sum(len(h['display']) + 3 for h in headers) + 1
-                    print("-" * width)
-                    print("-" * width)
-                    print("0 rows in set")
-                    return
-
-                # 각 컬럼의 최대 너비 계산 (헤더 길이와 데이터 길이 중 큰 값)
-                column_widths = []
-                for h in headers:
-                    max_data_width = max(
-                        len(str(record.get(h['key'], 'NULL') if record.get(h['key']) is not None else 'NULL'))
-                        for record in records
-                    )
-                    column_widths.append(max(len(h['display']), max_data_width))
-
-                width = sum(w + 3 for w in column_widths) + 1
-
-                print("-" * width)
-                print(" " + " | ".join(f"{h['display']:<{w}}" for h, w in zip(headers, column_widths)) + " ")
-
-                for record in records:
-                    values = []
-                    for h, w in zip(headers, column_widths):
-                        value = record[h['key']]
-                        value_str = "null" if value is None else str(value)
-                        values.append(f"{value_str:<{w}}")
-                    print(" " + " | ".join(values) + " ")
-                
-                print("-" * width)
-                print(f"{len(records)} row{'' if len(records) == 1 else 's'} in set")
-
-        # main logic (from/join의 테이블 cartesian product -> apply joins -> apply where conditions -> sort -> format output)
-        records = generate_cartesian_product()
-        records = apply_joins(records)
-        records = apply_conditions(records)
-        records = sort_orders(records)
-        format_output(records)
-
-    def _insert_query(self, table_name, column_list, value_list):
-        """helper function of insert_query"""
+            headers = []
+            outputs = []
+            for col in columns_to_process:
+                if col['type'] == 'total_count':
+                    headers.append('count(*)' if col['alias'] == '' else col['alias'])
+                    outputs.append(('count(*)', None, None))
+                    continue
+
+                col_name = col['column_name']
+                table = resolve_column_reference(col_name, col['table_name'] or None, "SELECT")
+                if col['type'] == 'aggregate':
+                    func = col['aggregate_func']
+                    headers.append(col['alias'] or f"{func}({table}.{col_name})")
+                    column_type = tables_info[table]['metadata']['columns_metadata'][col_name]['type']
+                    outputs.append((func, f"{table}.{col_name}", column_type))
+                else:
+                    headers.append(col['alias'] or f"{table}.{col_name}")
+                    column_type = tables_info[table]['metadata']['columns_metadata'][col_name]['type']
+                    outputs.append((f"{table}.{col_name}", column_type))
+            return headers, has_aggregate, outputs
+
+        # main logic (join/where 조건 검증 및 한 테이블만 참조하는 where 조건을 scan 단계로 push down, 비교하는 column에 null이 있으면
+        # push down 없이 join 결과에 where 전체를 적용 -> baseline과 같은 row에서 비교 오류)
+        # -> operator tree: scan (+ filter) -> 추정 row 수로 정한 순서의 hash join (연결되지 않은 테이블끼리만 cartesian product, 여러 테이블 조건은 filter)
+        # -> sort -> project / aggregate
+        # rows are pulled through the tree one by one, only hash join (build side), cartesian product (inner table) and sort keep rows)
+        # limit stops pulling rows once it has enough, order by + limit keeps only the top offset+limit rows (top-n heap)
+        join_conditions = check_join_conditions()
+        table_predicates, join_predicates = plan_conditions()
+        sort_keys = plan_sort()
+        headers, is_aggregate, outputs = plan_output()
+
+        plan = None
+        if is_aggregate:
+            plan = plan_metadata_aggregate(outputs) or plan_columnar_aggregate(table_predicates, join_predicates, outputs)
+        if plan is None:
+            plan = plan_joins(join_conditions, table_predicates, join_predicates)
+            if is_aggregate:
+                # the order of the rows does not change the aggregates
+                plan = Aggregate(plan, outputs)
+        if is_aggregate:
+            if select_limit:
+                plan = Limit(plan, *select_limit)
+        elif sort_keys and select_limit:
+            plan = Project(TopN(plan, sort_keys, *select_limit), outputs)
+        else:
+            if sort_keys:
+                plan = Sort(plan, sort_keys)
+            elif select_limit:
+                plan = Limit(plan, *select_limit)
+            plan = Project(plan, outputs)
+
+        if explain is None:
+            # type of each output value: count/sum are int, max/min have the type of their column
+            column_types = [output[-1] if not is_aggregate or output[0] in ('max', 'min') else 'int' for output in outputs]
+            rows = plan
+            if select_condition_list and compares_nulls():
+                # a null value in a compared column can fail the statement at any row, so all rows are produced before
+                # the first one is written (no partial result before the error message)
+                rows = list(plan)
+            self.result_sink.write(headers, column_types, rows, "NULL" if is_aggregate else "null")
+        elif explain == "analyze":
+            # run the query without printing the result
+            plan = profile(plan)
+            start = time.perf_counter()
+            for _ in plan:
+                pass
+            print_plan(plan)
+            print(f"execution time: {(time.perf_counter() - start) * 1000:.3f} ms")
+        else:
+            print_plan(plan)
+
+    def _insert_query(self, table_name, column_list, value_lists):
+        """helper function of insert_query and load_data_query, value_lists has the values of each row.
+        every row is validated before the first one is written, so either all rows are inserted or none"""
         # check if table exists
         table_metadata = self._get_table_metadata(table_name)
         if table_metadata == None:
             Messages.NoSuchTable("Insert")
             raise QueryError
 
+        records = [self._build_record(table_metadata, column_list, value_list) for value_list in value_lists]
+        self._insert_records(table_name, table_metadata, records)
+        Messages.InsertResult(len(records))
+
+    def _build_record(self, table_metadata, column_list, value_list):
+        """Validate the values of one row ({"value", "value_type"} in column_list order) and build the record."""
         columns_metadata = table_metadata["columns_metadata"]
         ordered_column_list = table_metadata["columns"]
         ordered_value_list = []
@@ -789,142 +2708,209 @@ class MyTransformer(Transformer):
         new_record = {}
         # check if all values are in correct type and insert them into the new record
         for column_name, value in zip(ordered_column_list, ordered_value_list):
-            if value['value_type'] == 'int':
-                if columns_metadata[column_name]['type'] != 'int':
-                    Messages.InsertTypeMismatchError()
-                    raise QueryError
-                new_record[column_name] = int(value['value'])
-            elif value['value_type'] == 'str':
-                if not columns_metadata[column_name]['type'].startswith('char'):
-                    Messages.InsertTypeMismatchError()
-                    raise QueryError
-                # if char and value is longer than the length, truncate the value
-                max_length = int(columns_metadata[column_name]['type'].split('(')[1].split(')')[0])
-                value = value['value'][1:][:-1]
-                new_record[column_name] = value[:max_length]
-            elif value['value_type'] == 'date':
-                if columns_metadata[column_name]['type'] != 'date':
-                    Messages.InsertTypeMismatchError()
-                    raise QueryError
-                # do nothing for date type
-                new_record[column_name] = value['value']
-            else: # value['value_type'] == 'null'
+            if value['value_type'] == 'null':
                 # null is compatible with all types, but the column must be nullable
                 if columns_metadata[column_name]['not_null']:
                     Messages.InsertColumnNonNullableError(column_name)
                     raise QueryError
                 new_record[column_name] = None
-        # insert the new record into the table data
-        table_data = self._get_table_data(table_name)
-        table_data.append(new_record)
-        myDB.put(f'data:{table_name}'.encode(), json.dumps(table_data).encode())
+            else:
+                new_record[column_name] = self._column_value(columns_metadata[column_name], value, Messages.InsertTypeMismatchError)
+        return new_record
+
+    def _column_value(self, column_metadata, value, type_mismatch):
+        """Convert a (non null) value ({"value", "value_type"}) to the stored value of the column.
+        type_mismatch is the message printed if the value does not fit the column type"""
+        if value['value_type'] == 'int':
+            if column_metadata['type'] != 'int':
+                type_mismatch()
+                raise QueryError
+            result = int(value['value'])
+            if not -(1 << 63) <= result < 1 << 63:
+                # ints are stored in 8 bytes
+                type_mismatch()
+                raise QueryError
+            return result
+        elif value['value_type'] == 'str':
+            if not column_metadata['type'].startswith('char'):
+                type_mismatch()
+                raise QueryError
+            # if char and value is longer than the length, truncate the value
+            max_length = int(column_metadata['type'].split('(')[1].split(')')[0])
+            return value['value'][1:][:-1][:max_length]
+        else: # value['value_type'] == 'date'
+            if column_metadata['type'] != 'date':
+                type_mismatch()
+                raise QueryError
+            # stored as an ordinal, converted back to YYYY-MM-DD only for the output
+            try:
+                return parse_date(value['value'])
+            except ValueError:
+                # not a valid date (e.g. 2024-02-30)
+                type_mismatch()
+                raise QueryError
 
-        Messages.InsertResult()
+    def _insert_records(self, table_name, table_metadata, records):
+        """Check the primary keys of the validated records (against the table and each other) and write them."""
+        primary_key = self._get_primary_key(table_metadata)
+        columnar_table = self._columnar_table(table_name)
+        if columnar_table is not None:
+            # the primary key is checked with one lookup per row (its colkey entry) and against the other new rows
+            if primary_key:
+                keys = {tuple(record[column] for column in primary_key) for record in records}
+                if len(keys) != len(records) or any(columnar_table.contains(record) for record in records):
+                    Messages.InsertDuplicatePrimaryKeyError()
+                    raise QueryError
+            columnar_table.extend(records)
+            self._record_changes(table_name, inserted=records)
+            return
 
-    def _delete_query_check_condition(self, columns_metadata, record, condition):
-        """Check if the record matches the condition."""           
-        def get_value(operand):
-            # get the value and type of the operand (and preprocess the value)
-            if operand.get("type") == "column_name":
-                value = record[operand["column_name"]]
-                type_ = columns_metadata[operand["column_name"]]["type"]
-            else: # "comparable_value"
-                value = operand["value"]
-                type_ = operand["value_type"]
-                if type_ == "int":
-                    value = int(value)
-                elif type_ == "str":
-                    value = value[1:][:-1]
-            
-            # preprocess the value for comparison
-            if type_ == "date" and value is not None:
-                value = datetime.strptime(value, "%Y-%m-%d")
-            
-            return value
-
-        # no issue of ambiguous column name
-        if condition["type"] == 'null predicate':
-            value = record[condition["column_name"]]
-            is_null = value is None
-            result = (is_null == condition["is_null"])
-            # apply not operator
-            return not result if condition["not"] else result
-        
-        operand1 = condition["comp_operand_1"]
-        operand2 = condition["comp_operand_2"]
-        
-        value1 = get_value(operand1)
-        value2 = get_value(operand2)
-        
-        # cannot compare null value
-        if value1 is None or value2 is None:
+        if primary_key:
+            # check the primary key with one lookup per row
+            keys = [self._new_row_key(table_name, table_metadata, record) for record in records]
+            if len(set(keys)) != len(keys) or any(myDB.get(key) is not None for key in keys):
+                Messages.InsertDuplicatePrimaryKeyError()
+                raise QueryError
+        else:
+            # the rowids of all rows are allocated at once
+            first_rowid = self._next_rowid(table_name, len(records))
+            keys = [self._row_key(table_name, first_rowid + i) for i in range(len(records))]
+
+        if not self._referenced_rows_exist(table_name, records):
+            Messages.InsertReferentialIntegrityError()
+            raise QueryError
+
+        encode = self.catalog.row_codec(table_name).encode
+        for key, record in zip(keys, records):
+            myDB.put(key, encode(record))
+        self._record_changes(table_name, inserted=records)
+
+    def _literal_value(self, operand):
+        """Convert a comparable_value operand to the value stored in the records."""
+        if operand["value_type"] == "int":
+            return int(operand["value"])
+        elif operand["value_type"] == "str":
+            return operand["value"][1:][:-1]
+        # date is compared as an ordinal, converted once per query
+        try:
+            return parse_date(operand["value"])
+        except ValueError:
             Messages.IncomparableError()
             raise QueryError
-        
-        # values are either integer, string, or date
-        comp_ops = {
-            "=": lambda x, y: x == y,
-            "!=": lambda x, y: x != y,
-            ">": lambda x, y: x > y,
-            ">=": lambda x, y: x >= y,
-            "<": lambda x, y: x < y,
-            "<=": lambda x, y: x <= y,
-        }
-        result = comp_ops[condition["comp_op"]](value1, value2)
-        # apply not operator
-        return not result if condition["not"] else result
-    
-    def _delete_query_validate_condition(self, table_name, columns_metadata, condition):
-        """Validate the condition without checking actual records."""
-        def check_table_name(table):
-            # check if table name is specified and matches the table name
-            if table and table != table_name:
-                Messages.TableNotSpecified("WHERE")
-                raise QueryError
-        
-        def check_column_exists(column):
-            if column not in columns_metadata:
-                Messages.ColumnNotExist("WHERE")
-                raise QueryError
-            
-        def get_type(operand):
+
+    def _compile_condition(self, condition, resolve):
+        """Validate one where condition and compile it into a predicate (record -> bool).
+        resolve(table_name, column_name) returns (record key, column type) of a column operand,
+        columns and literals are resolved/converted here once, not per record."""
+        negate = condition["not"]
+
+        if condition["type"] == "null predicate":
+            key, _ = resolve(condition.get("table_name", ""), condition["column_name"])
+            expected = condition["is_null"] != negate
+            return lambda record: (record[key] is None) == expected
+
+        def compile_operand(operand):
+            # returns (is_column, record key or converted literal, type)
             if operand.get("type") == "column_name":
-                check_column_exists(operand["column_name"])
-                type_ = columns_metadata[operand["column_name"]]["type"]
-            else: # "comparable_value"
+                key, type_ = resolve(operand.get("table_name", ""), operand["column_name"])
+                is_column = True
+            else: # comparable_value
+                key = self._literal_value(operand)
                 type_ = operand["value_type"]
-            
+                is_column = False
+
             if type_ == "str" or type_.startswith("char"):
                 type_ = "char"
-            return type_
+            return is_column, key, type_
 
-        # null predicate 검증
-        if condition["type"] == 'null predicate':
-            check_table_name(condition["table_name"])
-            check_column_exists(condition["column_name"])
-            return
-        
-        operand1 = condition["comp_operand_1"]
-        operand2 = condition["comp_operand_2"]
+        is_column1, operand1, type1 = compile_operand(condition["comp_operand_1"])
+        is_column2, operand2, type2 = compile_operand(condition["comp_operand_2"])
 
-        if operand1.get("table_name"):
-            check_table_name(operand1["table_name"])
-        if operand2.get("table_name"):
-            check_table_name(operand2["table_name"])
-        
-        type1 = get_type(operand1)
-        type2 = get_type(operand2)
-
-        # 타입 일치 검증
+        # type check
         if type1 != type2:
             Messages.IncomparableError()
             raise QueryError
         
-        # char 타입의 비교 연산자 제약 검증
+        # char type cannot be compared with other operators
         if type1 == type2 == "char" and condition["comp_op"] not in ["=", "!="]:
             Messages.IncomparableError()
             raise QueryError
 
+        comp_op = COMP_OPS[condition["comp_op"]]
+
+        def incomparable():
+            # cannot compare null value
+            Messages.IncomparableError()
+            raise QueryError
+
+        if is_column1 and is_column2:
+            def predicate(record):
+                value1 = record[operand1]
+                value2 = record[operand2]
+                if value1 is None or value2 is None:
+                    incomparable()
+                return comp_op(value1, value2) != negate
+        elif is_column1:
+            def predicate(record):
+                value = record[operand1]
+                if value is None:
+                    incomparable()
+                return comp_op(value, operand2) != negate
+        elif is_column2:
+            def predicate(record):
+                value = record[operand2]
+                if value is None:
+                    incomparable()
+                return comp_op(operand1, value) != negate
+        else:
+            result = comp_op(operand1, operand2) != negate
+            predicate = lambda record: result
+        return predicate
+
+    def _condition_text(self, condition):
+        """SQL text of a where condition (shown by EXPLAIN)."""
+        def operand_text(operand):
+            if operand.get("type") == "column_name":
+                return f"{operand['table_name']}.{operand['column_name']}" if operand.get("table_name") else operand["column_name"]
+            return operand["value"]
+
+        if condition["type"] == "null predicate":
+            column = condition["column_name"]
+            if condition.get("table_name"):
+                column = f"{condition['table_name']}.{column}"
+            text = f"{column} is {'' if condition['is_null'] else 'not '}null"
+        else:
+            text = f"{operand_text(condition['comp_operand_1'])} {condition['comp_op']} {operand_text(condition['comp_operand_2'])}"
+        return f"not {text}" if condition["not"] else text
+
+    def _combine_predicates(self, bool_op, predicates):
+        """Combine compiled predicates with AND / OR (SINGLE has one predicate).
+        both sides are always evaluated, so a NULL comparison on either side is reported as before."""
+        if len(predicates) == 1:
+            return predicates[0]
+        predicate1, predicate2 = predicates
+        if bool_op == "AND":
+            return lambda record: predicate1(record) & predicate2(record)
+        return lambda record: predicate1(record) | predicate2(record)
+
+    def _compile_conditions(self, condition_list, resolve):
+        """Compile the whole condition list (["SINGLE", c] / ["AND", c1, c2] / ["OR", c1, c2]) into one predicate."""
+        predicates = [self._compile_condition(condition, resolve) for condition in condition_list[1:]]
+        return self._combine_predicates(condition_list[0], predicates)
+
+    def _delete_all_rows(self, table_name):
+        """Delete every row of the table and return the number of deleted rows."""
+        prefix = f'row:{table_name}:'.encode()
+        num_deleted_rows = 0
+        cursor = myDB.cursor()
+        x = cursor.set_range(prefix)
+        while x is not None and x[0].startswith(prefix):
+            cursor.delete()
+            num_deleted_rows += 1
+            x = cursor.next()
+        myTransactions.close_cursor(cursor)
+        return num_deleted_rows
+
     def _delete_query(self, table_name, condition_list):
         """helper function of delete_query"""
         # check if table exists
@@ -933,60 +2919,301 @@ class MyTransformer(Transformer):
             Messages.NoSuchTable("Delete")
             raise QueryError
         
-        table_data = self._get_table_data(table_name)
+        columnar_table = self._columnar_table(table_name)
+
+        # a referenced table is deleted row by row to keep the referenced rows
+        referenced = any(ref_table_name == table_name for _, ref_table_name in self.catalog.references)
+
         # if condition_list is empty, delete all rows
-        if len(condition_list) == 0:
-            num_deleted_rows = len(table_data)
-            myDB.put(f'data:{table_name}'.encode(), json.dumps([]).encode())
+        if len(condition_list) == 0 and not referenced:
+            if columnar_table is not None:
+                num_deleted_rows = columnar_table.delete()
+            else:
+                num_deleted_rows = self._delete_all_rows(table_name)
+            # the statistics of an empty table
+            TableStatistics(table_name, table_metadata).save()
             Messages.DeleteResult(num_deleted_rows)
             return
         
-        delete_index_list = []
-        if condition_list[0] == "SINGLE":
-            condition = condition_list[1]
-            
-            # 조건 검증 먼저 (table이 비어있어도 조건 검증 반드시 이루어짐)
-            self._delete_query_validate_condition(table_name, table_metadata["columns_metadata"], condition)
-
-            # find the index of the record that matches the condition
-            for i, record in enumerate(table_data):
-                if self._delete_query_check_condition(table_metadata["columns_metadata"], record, condition):
-                    delete_index_list.append(i)
-            
-            # delete the records
-            for index in sorted(delete_index_list, reverse=True):
-                del table_data[index]
-            myDB.put(f'data:{table_name}'.encode(), json.dumps(table_data).encode())
-            Messages.DeleteResult(len(delete_index_list))
+        # 조건 검증 먼저 (table이 비어있어도 조건 검증 반드시 이루어짐)
+        predicate = self._table_predicate(table_name, table_metadata, condition_list, "WHERE")
+
+        if columnar_table is not None:
+            # the remaining rows are written again
+            deleted = []
+            columnar_table.delete(predicate, deleted)
+            self._record_changes(table_name, deleted=deleted)
+            Messages.DeleteResult(len(deleted))
             return
-        else: # condition_list[0] == "AND" or condition_list[0] == "OR"
-            condition1 = condition_list[1]
-            condition2 = condition_list[2]
-            delete_index_list_1 = []
-            delete_index_list_2 = []
-
-            # 조건 검증 먼저 (table이 비어있어도 조건 검증 반드시 이루어짐)
-            self._delete_query_validate_condition(table_name, table_metadata["columns_metadata"], condition1)
-            self._delete_query_validate_condition(table_name, table_metadata["columns_metadata"], condition2)
-
-            # find the index of the records that match the conditions
-            for i, record in enumerate(table_data):
-                if self._delete_query_check_condition(table_metadata["columns_metadata"], record, condition1):
-                    delete_index_list_1.append(i)
-                if self._delete_query_check_condition(table_metadata["columns_metadata"], record, condition2):
-                    delete_index_list_2.append(i)
-            
-            if condition_list[0] == "AND":
-                delete_index_list = list(set(delete_index_list_1) & set(delete_index_list_2))
-            elif condition_list[0] == "OR":
-                delete_index_list = list(set(delete_index_list_1) | set(delete_index_list_2))
+
+        matches = self._matching_rows(table_name, table_metadata, condition_list, predicate)
+        kept_count = 0
+        if referenced:
+            # the rows referenced by another table are not deleted
+            kept_count = len(matches)
+            matches = [(key, record) for key, record in matches if not self._is_referenced(table_name, key)]
+            kept_count -= len(matches)
         
-        # delete the records
-        for index in sorted(delete_index_list, reverse=True):
-            del table_data[index]
-        myDB.put(f'data:{table_name}'.encode(), json.dumps(table_data).encode())
-        Messages.DeleteResult(len(delete_index_list))
-                    
+        # delete the records (only the matched rows are touched)
+        for key, _ in matches:
+            myDB.delete(key)
+        self._record_changes(table_name, deleted=[record for _, record in matches])
+        Messages.DeleteResult(len(matches))
+        if kept_count:
+            Messages.DeleteReferentialIntegrityPassed(kept_count)
+
+    def _table_predicate(self, table_name, table_metadata, condition_list, clause_name):
+        """Compile the where conditions of a single table statement (DELETE / UPDATE), None if there is no condition."""
+        if len(condition_list) == 0:
+            return None
+        columns_metadata = table_metadata["columns_metadata"]
+        def resolve(table, column):
+            # check if table name is specified and matches the table name
+            if table and table != table_name:
+                Messages.TableNotSpecified(clause_name)
+                raise QueryError
+            if column not in columns_metadata:
+                Messages.ColumnNotExist(clause_name)
+                raise QueryError
+            return column, columns_metadata[column]["type"]
+        return self._compile_conditions(condition_list, resolve)
+
+    def _matching_rows(self, table_name, table_metadata, condition_list, predicate):
+        """(key, record) of the rows satisfying predicate (all rows if None), read with an index if possible.
+        the rows are collected before they are returned, so the caller can write them"""
+        access = None
+        if condition_list and condition_list[0] != "OR":
+            access = self._find_index_access(table_metadata, condition_list[1:], self._table_statistics(table_name))
+        return [(key, record) for key, record in self._scan_access(table_name, access) if predicate is None or predicate(record)]
+
+    def _update_query(self, table_name, column_name, value, condition_list):
+        """helper function of update_query, set column_name to value ({"value", "value_type"}) in the matching rows.
+        only the rows whose value changes are written, the associated indexes update their entries of the changed rows"""
+        # check if table exists
+        table_metadata = self._get_table_metadata(table_name)
+        if table_metadata == None:
+            Messages.NoSuchTable("Update")
+            raise QueryError
+
+        columns_metadata = table_metadata["columns_metadata"]
+        if column_name not in columns_metadata:
+            Messages.UpdateColumnExistenceError(column_name)
+            raise QueryError
+        new_value = self._column_value(columns_metadata[column_name], value, Messages.UpdateTypeMismatchError)
+
+        predicate = self._table_predicate(table_name, table_metadata, condition_list, "WHERE")
+        primary_key = self._get_primary_key(table_metadata)
+
+        columnar_table = self._columnar_table(table_name)
+        if columnar_table is not None:
+            # only the segments of the updated column are written
+            old_values = []
+            count = columnar_table.update(column_name, new_value, predicate, old_values)
+            statistics = self._table_statistics(table_name, db.DB_RMW)
+            statistics.change(column_name, old_values, new_value)
+            statistics.save()
+            Messages.UpdateResult(count)
+            return
+
+        matches = self._matching_rows(table_name, table_metadata, condition_list, predicate)
+        changed = [(key, record) for key, record in matches if record[column_name] != new_value]
+        old_values = [record[column_name] for _, record in changed]
+        for _, record in changed:
+            record[column_name] = new_value
+
+        # the new foreign key must reference an existing row, a referenced primary key cannot change
+        references = self.catalog.references
+        if any(child_table_name == table_name and column_name in references[(child_table_name, ref_table_name)]
+               for child_table_name, ref_table_name in references):
+            if not self._referenced_rows_exist(table_name, [record for _, record in changed]):
+                Messages.UpdateReferentialIntegrityError()
+                raise QueryError
+        if column_name in primary_key and any(self._is_referenced(table_name, key) for key, _ in changed):
+            Messages.UpdateReferentialIntegrityError()
+            raise QueryError
+
+        encode = self.catalog.row_codec(table_name).encode
+        if column_name in primary_key and changed:
+            # the row key changes, the new keys must not be used by another row (or by each other)
+            old_keys = {key for key, _ in changed}
+            new_keys = [self._new_row_key(table_name, table_metadata, record) for _, record in changed]
+            if len(set(new_keys)) != len(new_keys) or any(key not in old_keys and myDB.get(key) is not None for key in new_keys):
+                Messages.UpdateDuplicatePrimaryKeyError()
+                raise QueryError
+            for key in old_keys:
+                myDB.delete(key)
+            for key, (_, record) in zip(new_keys, changed):
+                myDB.put(key, encode(record))
+        else:
+            # the key stays the same, the row is overwritten in place
+            for key, record in changed:
+                myDB.put(key, encode(record))
+        statistics = self._table_statistics(table_name, db.DB_RMW)
+        statistics.change(column_name, old_values, new_value)
+        statistics.save()
+        Messages.UpdateResult(len(matches))
+
+    def _migrate_database(self):
+        """Upgrade the data of an older layout to FORMAT_VERSION (meta:format_version).
+        returns True if the rows have been rewritten (the indexes are not associated yet)
+        raises QueryError (after printing the rows) if some rows cannot be upgraded, nothing is changed then"""
+        value = myDB.get(b'meta:format_version')
+        version = int(value.decode()) if value else 0
+        if version == FORMAT_VERSION:
+            return False
+        rows_rewritten = version < 2
+
+        def json_rows(table_name):
+            # (key, record) of the rows before version 5 (json objects)
+            return [(key, json.loads(value.decode())) for key, value in iter_prefix(f'row:{table_name}:'.encode())]
+
+        def row_text(table_metadata, key, record):
+            # a row in the messages: "primary key (1, 2024-01-01)", or "rowid 3" in a table without primary key
+            primary_key = self._get_primary_key(table_metadata)
+            if not primary_key:
+                return f"rowid {int(key.decode().rsplit(':', 1)[1])}"
+            columns_metadata = table_metadata["columns_metadata"]
+            values = [format_date(record[column]) if columns_metadata[column]["type"] == "date" and isinstance(record[column], int)
+                      else record[column] for column in primary_key]
+            return "primary key (" + ", ".join(str(value) for value in values) + ")"
+
+        if version < 1:
+            # data:<table_name> (one json list) -> row:<table_name>:<rowid> (one json object per row)
+            legacy_keys = []
+            cursor = myDB.cursor()
+            x = cursor.set_range(b'data:')
+            while x is not None and x[0].startswith(b'data:'):
+                legacy_keys.append(x[0])
+                x = cursor.next()
+            myTransactions.close_cursor(cursor)
+            for key in legacy_keys:
+                table_name = key.decode().replace('data:', '')
+                for record in json.loads(myDB.get(key).decode()):
+                    myDB.put(self._row_key(table_name, self._next_rowid(table_name)), json.dumps(record).encode())
+                myDB.delete(key)
+
+        if version < 4:
+            # YYYY-MM-DD strings -> ordinals in the rows (and in the keys of a primary key with a date column)
+            # done before the primary key re-keying of version 2, which encodes the dates as ordinals
+            # invalid dates are reported and the upgrade is rolled back
+            invalid = False
+            for table_name in self._get_table_names():
+                table_metadata = self._get_table_metadata(table_name)
+                columns_metadata = table_metadata["columns_metadata"]
+                date_columns = [column for column in table_metadata["columns"] if columns_metadata[column]["type"] == "date"]
+                if not date_columns:
+                    continue
+                rows_rewritten = True
+                primary_key = self._get_primary_key(table_metadata)
+                rekey = version >= 2 and any(column in date_columns for column in primary_key)
+                rows = json_rows(table_name)
+                if rekey:
+                    self._delete_all_rows(table_name)
+                for key, record in rows:
+                    text = row_text(table_metadata, key, record)
+                    for column in date_columns:
+                        if record[column] is not None:
+                            try:
+                                record[column] = parse_date(record[column])
+                            except ValueError:
+                                # invalid dates (e.g. 2024-02-30) were accepted before, they cannot be stored as ordinals
+                                Messages.UpgradeInvalidDateError(table_name, text, column, record[column])
+                                invalid = True
+                    if invalid:
+                        continue
+                    if rekey:
+                        key = self._new_row_key(table_name, table_metadata, record)
+                    myDB.put(key, json.dumps(record).encode())
+            if invalid:
+                raise QueryError
+
+        if version < 2:
+            # row:<table_name>:<rowid> -> row:<table_name>:<encoded primary key> for tables with a primary key
+            # duplicated primary keys were not rejected before, they are reported and the upgrade is rolled back
+            duplicated = False
+            for table_name in self._get_table_names():
+                table_metadata = self._get_table_metadata(table_name)
+                if not self._get_primary_key(table_metadata):
+                    continue
+                rows = json_rows(table_name)
+                self._delete_all_rows(table_name)
+                for _, record in rows:
+                    key = self._new_row_key(table_name, table_metadata, record)
+                    if myDB.get(key) is not None:
+                        Messages.UpgradeDuplicatePrimaryKeyError(table_name, row_text(table_metadata, key, record))
+                        duplicated = True
+                        continue
+                    myDB.put(key, json.dumps(record).encode())
+                if myDB.get(f'rowid:{table_name}'.encode()) is not None:
+                    myDB.delete(f'rowid:{table_name}'.encode())
+            if duplicated:
+                raise QueryError
+
+        if version < 3:
+            # add referenced_by:<referenced table_name>:<table_name> for the existing references
+            for table_name, ref_table_name in self.catalog.references:
+                myDB.put(f'referenced_by:{ref_table_name}:{table_name}'.encode(), b'')
+
+        if version < 5:
+            # json object -> binary row (RowCodec), the keys do not change
+            for table_name in self._get_table_names():
+                codec = self.catalog.row_codec(table_name)
+                for key, record in json_rows(table_name):
+                    myDB.put(key, codec.encode(record))
+
+        if version < 6:
+            # statistics of the existing tables
+            for table_name in self._get_table_names():
+                self._analyze_table(table_name)
+
+        if version < 7:
+            # primary key entries of the columnar tables (their duplicate check read the whole key columns before)
+            for table_name in self._get_table_names():
+                columnar_table = self._columnar_table(table_name)
+                if columnar_table is not None:
+                    columnar_table.add_keys(columnar_table.rows())
+
+        myDB.put(b'meta:format_version', str(FORMAT_VERSION).encode())
+        return rows_rewritten
+
+    def _open_indexes(self, rebuild=False):
+        """Open and associate the indexes stored in the database (index:<index_name>).
+        with rebuild=True the index files are built again from the rows"""
+        for index_name, index_metadata in self.catalog.indexes.items():
+            if index_name in myIndexes:
+                if not rebuild:
+                    continue
+                close_index(index_name)
+            table_name = index_metadata["table_name"]
+            column_name = index_metadata["column_name"]
+            column_type = self._get_table_metadata(table_name)["columns_metadata"][column_name]["type"]
+            if rebuild and os.path.exists(index_file_name(index_name)):
+                myEnv.dbremove(index_file_name(index_name), txn=myTransactions.current)
+            open_index(index_name, table_name, column_name, self.catalog.row_codec(table_name), column_type, create=rebuild)
+
+        for table_name, ref_table_name in self.catalog.references:
+            if (table_name, ref_table_name) in myReferenceIndexes:
+                if not rebuild:
+                    continue
+                close_reference_index(table_name, ref_table_name)
+            file_name = reference_index_file_name(table_name, ref_table_name)
+            if rebuild and os.path.exists(file_name):
+                myEnv.dbremove(file_name, txn=myTransactions.current)
+            # the file is missing in a database created before the foreign keys were enforced
+            create = rebuild or not os.path.exists(file_name)
+            columns, column_types = self._reference_columns(table_name, ref_table_name)
+            open_reference_index(table_name, ref_table_name, columns, column_types, self.catalog.row_codec(table_name), create=create)
+
+    def _reload_metadata(self):
+        """Read the catalog again after a rollback and reopen the indexes to match it
+        (handles opened in the rolled back transaction are closed, the ones of dropped indexes reopened)"""
+        self.catalog.load()
+        for index_name in list(myIndexes):
+            close_index(index_name)
+        for reference in list(myReferenceIndexes):
+            close_reference_index(*reference)
+        self._open_indexes()
+
     # *_query functions handle the SQL queries
     def create_table_query(self, items):
         """Handle the create table query."""
@@ -1029,13 +3256,27 @@ class MyTransformer(Transformer):
                 "ref_column_list": ref_column_list
             })
 
-        self._create_table(table_name, column_definition, primary_key, foreign_key)
+        # CREATE TABLE ... USING COLUMNAR
+        layout = "row" if items[4] is None else "columnar"
+        self._create_table(table_name, column_definition, primary_key, foreign_key, layout)
 
     def drop_table_query(self, items):
         """Handle the drop table query."""
         table_name = items[2].children[0].lower()
         self._drop_table(table_name)
 
+    def create_index_query(self, items):
+        """Handle the create index query."""
+        index_name = items[2].children[0].lower()
+        table_name = items[4].children[0].lower()
+        column_name = items[6].children[0].lower()
+        self._create_index(index_name, table_name, column_name)
+
+    def drop_index_query(self, items):
+        """Handle the drop index query."""
+        index_name = items[2].children[0].lower()
+        self._drop_index(index_name)
+
     def explain_query(self, items):
         """Handle the explain query."""
         table_name = items[1].children[0].lower()
@@ -1064,11 +3305,87 @@ class MyTransformer(Transformer):
         if items[3]: # if column_name_list is not empty
             for column in list(items[3].find_data('column_name')):
                 column_list.append(column.children[0].lower())
-        for value in list(items[4].find_data('insert_value')):
-            # value_type is case sensitive (because it is a value)
-            value_list.append({"value": value.children[0].value, "value_type": value.children[0].type.lower()})
+        # value_list : VALUES value_tuple ("," value_tuple)*
+        value_lists = []
+        for value_tuple in items[4].children[1:]:
+            value_list = []
+            for value in value_tuple.children[1:-1]:
+                if isinstance(value, Tree): # insert_value (skip the commas)
+                    # value_type is case sensitive (because it is a value)
+                    value_list.append({"value": value.children[0].value, "value_type": value.children[0].type.lower()})
+            value_lists.append(value_list)
+
+        self._insert_query(table_name, column_list, value_lists)
+
+    def load_data_query(self, items):
+        """Handle the load data query (LOAD DATA 'file.csv' INTO TABLE table_name).
+        the file is read one row at a time and the validated rows are written LOAD_BATCH_ROWS at a time,
+        a row that fails rolls back the statement, so either all rows are inserted or none"""
+        file_name = items[2].value[1:][:-1]
+        table_name = items[5].children[0].lower()
+        table_metadata = self._get_table_metadata(table_name)
+        if table_metadata is None:
+            Messages.NoSuchTable("Load data")
+            raise QueryError
 
-        self._insert_query(table_name, column_list, value_list)
+        # one row per line with the values in column order
+        columns = table_metadata["columns"]
+        converters = [self._csv_converter(column, table_metadata["columns_metadata"][column]) for column in columns]
+        count = 0
+        records = []
+        try:
+            with open(file_name, newline='') as file:
+                for fields in csv.reader(file):
+                    if len(fields) != len(converters):
+                        Messages.InsertTypeMismatchError()
+                        raise QueryError
+                    records.append({column: convert(field) for column, convert, field in zip(columns, converters, fields)})
+                    if len(records) == LOAD_BATCH_ROWS:
+                        self._insert_records(table_name, table_metadata, records)
+                        count += len(records)
+                        records = []
+        except (OSError, UnicodeDecodeError, csv.Error):
+            # missing/unreadable file, not utf-8, or not csv (e.g. a field longer than csv.field_size_limit)
+            Messages.LoadDataFileError(file_name)
+            raise QueryError
+        if records:
+            self._insert_records(table_name, table_metadata, records)
+            count += len(records)
+        Messages.InsertResult(count)
+
+    def _csv_converter(self, column_name, column_metadata):
+        """Function converting a csv field to the stored value of the column, with the checks of _column_value.
+        \\N is null (an empty field or NULL too in an int or date column, in a char column they are strings),
+        int and date fields must have the form of the grammar's INT and DATE"""
+        column_type = column_metadata["type"]
+        is_char = column_type.startswith('char')
+
+        def convert(field):
+            if field == CSV_NULL or not is_char and (field == '' or field.upper() == 'NULL'):
+                if column_metadata["not_null"]:
+                    Messages.InsertColumnNonNullableError(column_name)
+                    raise QueryError
+                return None
+            if column_type == 'int':
+                if INT_PATTERN.fullmatch(field):
+                    value = int(field)
+                    # ints are stored in 8 bytes
+                    if -(1 << 63) <= value < 1 << 63:
+                        return value
+            elif column_type == 'date':
+                try:
+                    return parse_date(field)
+                except ValueError:
+                    pass
+            else:
+                # char(n), longer values are truncated like string literals
+                return field[:max_length]
+            Messages.InsertTypeMismatchError()
+            raise QueryError
+
+        if column_type.startswith('char'):
+            max_length = int(column_type.split('(')[1].split(')')[0])
+        return convert
 
     def _parse_comp_operand(self, operand):
         """Parse the comparison operand and return a dictionary."""
@@ -1192,13 +3509,29 @@ class MyTransformer(Transformer):
 
         self._delete_query(table_name, condition_list)
 
+    def query(self, items):
+        """Run a select query, the other queries have been run by their own methods (which return None).
+        a select_query is only parsed by select_query, because it is also the child of explain_select_query"""
+        if isinstance(items[0], tuple):
+            self._select_query(*items[0])
+
     def select_query(self, items):
-        """Handle the select query."""
+        """Parse the select query into the arguments of _select_query (run by query or explained by explain_select_query)."""
+        return self._parse_select(items)
+
+    def explain_select_query(self, items):
+        """Handle EXPLAIN [ANALYZE] SELECT ..., items[2] are the arguments parsed by select_query."""
+        explain = "plan" if items[1] is None else "analyze"
+        self._select_query(*items[2], explain=explain)
+
+    def _parse_select(self, items):
+        """Parse the children of select_query into the arguments of _select_query."""
         select_column_list = []
         select_table_list = []
         select_join_table_list = []
         select_condition_list = []
         select_order_by_list = []
+        select_limit = None
 
         # parse select_list first
         select_list = items[1]
@@ -1275,22 +3608,78 @@ class MyTransformer(Transformer):
                     "column_name": column_ref.children[1].children[0].value,
                     "direction": "asc" if order_item.children[1] is None else order_item.children[1].value.lower()
                 })
+
+        # parse limit_clause : LIMIT INT [OFFSET INT]
+        limit_clause = items[2].children[3]
+        if limit_clause:
+            limit = int(limit_clause.children[1].value)
+            offset = 0 if limit_clause.children[3] is None else int(limit_clause.children[3].value)
+            if limit < 0 or offset < 0:
+                Messages.LimitValueError()
+                raise QueryError
+            select_limit = (limit, offset)
         
-        # pass select_list, join_table_list (with join condition), condition_list, order_by info
-        self._select_query(select_column_list, select_table_list, select_join_table_list, select_condition_list, select_order_by_list)
+        # select_list, join_table_list (with join condition), condition_list, order_by info, (limit, offset)
+        return select_column_list, select_table_list, select_join_table_list, select_condition_list, select_order_by_list, select_limit
+
+    def analyze_query(self, items):
+        """Handle the analyze query (ANALYZE table_name), compute the statistics of the table again."""
+        table_name = items[1].children[0].lower()
+        if self._get_table_metadata(table_name) is None:
+            Messages.NoSuchTable("Analyze")
+            raise QueryError
+        self._analyze_table(table_name)
+        Messages.AnalyzeSuccess(table_name)
 
     def update_query(self, items):
-        pass
+        """Handle the update query (UPDATE table_name SET column_name = value [WHERE ...])."""
+        table_name = items[1].children[0].lower()
+        column_name = items[3].children[0].lower()
+        # value_type is case sensitive (because it is a value)
+        value = {"value": items[5].children[0].value, "value_type": items[5].children[0].type.lower()}
+        condition_list = []
+        where_clause = items[6]
+
+        if where_clause:
+            condition_list = self._parse_where_clause(where_clause)
+
+        self._update_query(table_name, column_name, value, condition_list)
+
+    def set_output_query(self, items):
+        """Handle SET OUTPUT TABLE | CSV | JSON, the format of the query results of this session."""
+        output_format = items[2].children[0].lower()
+        self.result_sink = RESULT_SINKS[output_format]()
+        Messages.OutputFormatSet(output_format)
+
+    def begin_query(self, items):
+        myTransactions.begin()
+        Messages.TransactionBegin()
+
+    def commit_query(self, items):
+        myTransactions.end(commit=True)
+        Messages.TransactionCommit()
+
+    def rollback_query(self, items):
+        myTransactions.end(commit=False)
+        self._reload_metadata()
+        Messages.TransactionRollback()
 
     def EXIT(self, items):
-        # Close the database
-        myDB.close()
+        close_database()
         # Exit the program
         exit()
 
-def get_input() -> str:
+def build_parser(grammar):
+    """Build the LALR(1) SQL parser.
+    the contextual lexer only matches the terminals the parser accepts at each position, so a keyword added to
+    the grammar (e.g. LOAD, DATA, INDEX) is still an identifier where a table or column name is expected
+    the compiled parse table is cached on disk (keyed by a hash of the grammar), so later runs only unpickle it"""
+    return Lark(grammar, start="command", lexer="contextual", parser="lalr", cache=True)
+
+def get_input(prompt=True) -> str:
     """Get the input from the user. The input can be multiple lines."""
-    Messages.Prompt()
+    if prompt:
+        Messages.Prompt()
     input_string = ""
     while True:
         line = input()
@@ -1300,19 +3689,121 @@ def get_input() -> str:
             break
     return input_string.strip()
 
+def open_environment(home):
+    """Open (or join) the transactional environment of the database files.
+    the environment is shared by every run.py process using the directory: one lock table (page locks of the btrees)
+    and one memory pool, recovery from the log runs only when no other process is using it (DB_REGISTER)"""
+    myEnv.set_flags(db.DB_AUTO_COMMIT, 1)
+    # the log files that are not needed for recovery anymore are removed
+    myEnv.log_set_config(db.DB_LOG_AUTO_REMOVE, 1)
+    # a lock request that would close a cycle aborts one of the transactions (DBLockDeadlockError)
+    myEnv.set_lk_detect(db.DB_LOCK_DEFAULT)
+    myEnv.open(home, db.DB_CREATE | db.DB_REGISTER | db.DB_RECOVER | db.DB_INIT_TXN | db.DB_INIT_LOG | db.DB_INIT_MPOOL | db.DB_INIT_LOCK)
+
+def close_database():
+    """Commit the pending statements, close the indexes, the database and the environment."""
+    myTransactions.close()
+    for index_name in list(myIndexes):
+        close_index(index_name)
+    for reference in list(myReferenceIndexes):
+        close_reference_index(*reference)
+    myDB.close()
+    myEnv.txn_checkpoint()
+    myEnv.close()
+
+def open_database(path):
+    """Open the database file as a btree in the environment. A hash file written by an older version is copied into a btree first."""
+    if not os.path.exists(path):
+        open_environment(os.path.dirname(path) or '.')
+        myDB.open(path, dbtype=db.DB_BTREE, flags=db.DB_CREATE)
+        myDB.put(b'meta:format_version', str(FORMAT_VERSION).encode())
+        return
+
+    legacyDB = db.DB()
+    legacyDB.open(path, dbtype=db.DB_UNKNOWN, flags=db.DB_RDONLY)
+    if legacyDB.get_type() != db.DB_BTREE:
+        # hash keys are not ordered, so the whole file is rewritten once
+        newDB = db.DB()
+        newDB.open(path + '.tmp', dbtype=db.DB_BTREE, flags=db.DB_CREATE)
+        cursor = legacyDB.cursor()
+        x = cursor.first()
+        while x is not None:
+            newDB.put(x[0], x[1])
+            x = cursor.next()
+        cursor.close()
+        newDB.close()
+        legacyDB.close()
+        os.replace(path + '.tmp', path)
+    else:
+        legacyDB.close()
+    open_environment(os.path.dirname(path) or '.')
+    myDB.open(path, dbtype=db.DB_BTREE)
+
+def run_statement(transformer, action):
+    """Run action() in a statement transaction, returns False if it failed (the statement is rolled back).
+    the catalog is reloaded first if another process has changed it, a statement that loses a deadlock is run again
+    unless it has already written result rows"""
+    for _ in range(DEADLOCK_RETRIES + 1):
+        transformer.result_sink.written = False
+        myTransactions.begin_statement()
+        try:
+            if transformer.catalog.is_stale():
+                transformer._reload_metadata()
+            action()
+        except Exception as e:
+            # lark wraps the exceptions of the transformer (VisitError.orig_exc)
+            if isinstance(getattr(e, 'orig_exc', e), db.DBLockDeadlockError):
+                retry = myTransactions.retry_after_deadlock()
+                transformer._reload_metadata()
+                # the rows already written cannot be taken back, a rerun would print them again
+                if retry and not transformer.result_sink.written:
+                    continue
+                Messages.DeadlockError()
+                return False
+            # undo the statement (the previous statements are kept)
+            myTransactions.end_statement(False)
+            transformer._reload_metadata()
+            return False
+        myTransactions.end_statement(True)
+        return True
+    Messages.DeadlockError()
+    return False
+
+def start_session(transformer):
+    """Load the catalog, upgrade an older layout and open the indexes (after open_database).
+    the program exits if this fails"""
+    def start():
+        transformer.catalog.load()
+        upgraded = transformer._migrate_database()
+        # the indexes are built again if the upgrade has rewritten the rows
+        transformer._open_indexes(rebuild=upgraded)
+    if not run_statement(transformer, start):
+        # the database is left as it was (e.g. an upgrade found duplicated primary keys)
+        close_database()
+        exit(1)
+    myTransactions.commit_group()
+
 def main() -> None:
     with open('grammar.lark') as file:
-        sql_parser = Lark(file.read(), start="command", lexer="basic")
+        sql_parser = build_parser(file.read())
 
     transformer = MyTransformer()
-    if os.path.exists("myDB.db"):
-        myDB.open("myDB.db", dbtype=db.DB_HASH)
-    else:
-        myDB.open("myDB.db", dbtype=db.DB_HASH, flags=db.DB_CREATE)
+    open_database("myDB.db")
+    start_session(transformer)
 
     while True:        
+        # group commit: an interactive session commits before waiting for the user,
+        # a script commits once per GROUP_COMMIT_STATEMENTS statements
+        if sys.stdin.isatty() or myTransactions.statements >= GROUP_COMMIT_STATEMENTS:
+            myTransactions.commit_group()
         commands = []
-        user_inputs = get_input().split(';')
+        try:
+            # csv/json results piped to another program are not mixed with prompts
+            user_inputs = get_input(transformer.result_sink.prompt or sys.stdin.isatty()).split(';')
+        except EOFError:
+            # end of the script without exit;
+            close_database()
+            return
         # split the input into multiple commands and save them in a list
         for user_input in user_inputs[:-1]:
             # add the semicolon back to the command
@@ -1328,11 +3819,9 @@ def main() -> None:
                 Messages.SyntaxError()
                 break
             
-            try:
-                # Transform the parsed output into a database operation
-                transformer.transform(output)
-            except Exception as e:
-                break        
+            # Transform the parsed output into a database operation
+            if not run_statement(transformer, lambda: transformer.transform(output)):
+                break
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
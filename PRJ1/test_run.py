@@ -0,0 +1,192 @@
+import importlib.util, os, shutil, subprocess, sys, tempfile, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+@unittest.skipUnless(importlib.util.find_spec("berkeleydb"), "berkeleydb is not installed")
+class RunTest(unittest.TestCase):
+    """Run scripts with run.py in an empty directory (a new database for each test)."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        shutil.copy(os.path.join(HERE, 'grammar.lark'), self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_script(self, *statements):
+        """Output of run.py for the statements, one line per message (prompts removed)."""
+        script = "\n".join(statements) + "\nexit;\n"
+        output = subprocess.run([sys.executable, os.path.join(HERE, 'run.py')], input=script, text=True,
+                                cwd=self.directory, capture_output=True, check=True).stdout
+        return [line.strip() for line in output.replace("DB_MINSEO25> ", "\n").splitlines() if line.strip()]
+
+    def table_rows(self, output):
+        """Cells of the lines of printed tables (between the border lines, the header line included)."""
+        rows = []
+        inside = False
+        for line in output:
+            if set(line) == {"-"}:
+                inside = not inside
+            elif inside:
+                rows.append([cell.strip() for cell in line.split("|")])
+        return rows
+
+    def test_keywords_as_identifiers(self):
+        # keywords added to the grammar do not make existing table and column names a syntax error
+        output = self.run_script(
+            "create table data (load int not null, index char(4), using date, columnar int, primary key (load));",
+            "insert into data values (1, 'a', 2024-01-01, 2);",
+            "create index index on data (columnar);",
+            "select load, index from data where columnar = 2;",
+            "update data set index = 'b' where load = 1;",
+            "delete from data where using > 2024-01-02;",
+            "drop index index;",
+            "drop table data;",
+        )
+        self.assertNotIn("Syntax error", output)
+        self.assertIn("'data' table is created", output)
+        self.assertEqual(self.table_rows(output), [["data.load", "data.index"], ["1", "a"]])
+        self.assertIn("1 row updated", output)
+        self.assertIn("'data' table is dropped", output)
+
+    def test_load_data_is_all_or_nothing(self):
+        # the rows are written in batches, a failing row after the first batch still rolls back the whole file
+        with open(os.path.join(self.directory, 'rows.csv'), 'w') as file:
+            for i in range(2500):
+                file.write(f"{i},2024-01-01\n")
+            file.write("3000,20240101\n")
+        output = self.run_script(
+            "create table t (id int not null, d date, primary key (id));",
+            "load data 'rows.csv' into table t;",
+            "select count(*) from t;",
+        )
+        self.assertIn("Insert has failed: types are not matched", output)
+        self.assertEqual(self.table_rows(output), [["count(*)"], ["0"]])
+
+    def test_columnar_results_equal_row_store(self):
+        # the same statements on a row store and a columnar table, with null values in the compared columns
+        statements = [
+            "insert into t values (1, 10, 'a', 2024-01-01), (2, null, 'b', 2024-01-02), (3, 30, null, null);",
+            "insert into t values (1, 5, 'c', 2024-01-03);",
+            "select * from t where x > 5;",
+            "select * from t where id > 1 and x < 40;",
+            "select * from t where c = 'b' or id = 1;",
+            "select * from t where x is null or d is not null;",
+            "select count(*), max(x), min(d) from t where id >= 2;",
+            "update t set id = 3 where id = 1;",
+            "update t set x = 7 where id = 3;",
+            "delete from t where x > 10;",
+            "delete from t where id = 2;",
+            "select * from t;",
+        ]
+        outputs = []
+        for layout in ("", " using columnar"):
+            self.tearDown()
+            self.setUp()
+            outputs.append(self.run_script(
+                f"create table t (id int not null, x int, c char(4), d date, primary key (id)){layout};", *statements))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn("Trying to compare incomparable columns or values", outputs[0])
+        self.assertIn("Update has failed: primary key duplication", outputs[0])
+
+    def test_output_keywords_as_identifiers(self):
+        output = self.run_script(
+            "create table output (csv int, json char(4));",
+            "insert into output values (1, 'a');",
+            "select csv, json from output;",
+            "set output json;",
+            "select json from output as csv;",
+        )
+        self.assertNotIn("Syntax error", output)
+        self.assertEqual(self.table_rows(output), [["output.csv", "output.json"], ["1", "a"]])
+        self.assertIn('{"csv.json": "a"}', output)
+
+    def test_csv_output_loads_back(self):
+        # null is written as \\N, so it stays different from an empty string when the file is loaded again
+        output = self.run_script(
+            "create table t (id int not null, c char(4), d date, primary key (id));",
+            "insert into t values (1, '', 2024-01-01), (2, null, null), (3, 'a,b', 2024-02-03);",
+            "set output csv;",
+            "select * from t;",
+        )
+        lines = output[output.index("t.id,t.c,t.d") + 1:]
+        self.assertEqual(lines, ["1,,2024-01-01", "2,\\N,\\N", '3,"a,b",2024-02-03'])
+        with open(os.path.join(self.directory, 'rows.csv'), 'w') as file:
+            file.write("\n".join(lines) + "\n")
+        output = self.run_script(
+            "create table u (id int not null, c char(4), d date, primary key (id));",
+            "load data 'rows.csv' into table u;",
+            "select * from u where c is null;",
+            "set output csv;",
+            "select * from u;",
+        )
+        self.assertEqual(self.table_rows(output), [["u.id", "u.c", "u.d"], ["2", "null", "null"]])
+        self.assertEqual(output[output.index("u.id,u.c,u.d") + 1:], lines)
+
+    def test_table_columns_fit_long_values(self):
+        # the column widths do not depend on the first rows
+        values = ", ".join(f"({i}, 0)" for i in range(1500)) + ", (-9223372036854775808, 0)"
+        output = self.run_script(
+            "create table t (x int, y int);",
+            f"insert into t values {values};",
+            "select * from t;",
+        )
+        self.assertIn("1501 rows in set", output)
+        self.assertEqual({line.index("|") for line in output if "|" in line}, {len("-9223372036854775808") + 1})
+
+    def test_primary_key_literal_out_of_range(self):
+        # a literal outside the stored int range cannot be a primary key seek, the rows are compared instead
+        output = self.run_script(
+            "create table t (id int not null, v int, primary key (id));",
+            "insert into t values (1, 5), (2, 6);",
+            "select * from t where id = 99999999999999999999; select count(*) from t where id < 99999999999999999999;",
+            "delete from t where id > -99999999999999999999 and v = 5;",
+        )
+        self.assertIn("0 rows in set", output)
+        self.assertEqual(self.table_rows(output), [["count(*)"], ["2"]])
+        self.assertIn("1 row deleted", output)
+
+    def test_index_literal_out_of_range(self):
+        output = self.run_script(
+            "create table t (id int, v int);",
+            "insert into t values (1, 5), (2, 6);",
+            "create index t_v on t (v);",
+            "select * from t where v = 99999999999999999999; select count(*) from t where v <= 99999999999999999999;",
+            "update t set id = 3 where v > -99999999999999999999;",
+        )
+        self.assertIn("0 rows in set", output)
+        self.assertEqual(self.table_rows(output), [["count(*)"], ["2"]])
+        self.assertIn("2 rows updated", output)
+
+    def test_load_data_unreadable_file(self):
+        # a file that is not utf-8 csv is reported like a missing file
+        with open(os.path.join(self.directory, 'latin1.csv'), 'wb') as file:
+            file.write("1,caf\xe9\n".encode('latin-1'))
+        with open(os.path.join(self.directory, 'long.csv'), 'w') as file:
+            file.write("2," + "x" * 200000 + "\n")
+        output = self.run_script(
+            "create table t (id int, c char(4));",
+            "load data 'latin1.csv' into table t;",
+            "load data 'long.csv' into table t;",
+            "select count(*) from t;",
+        )
+        self.assertIn("Load data has failed: cannot read 'latin1.csv'", output)
+        self.assertIn("Load data has failed: cannot read 'long.csv'", output)
+        self.assertEqual(self.table_rows(output), [["count(*)"], ["0"]])
+
+    def test_stale_histogram_is_not_used(self):
+        # after ANALYZE the rows above the histogram are estimated with min/max once enough rows changed
+        output = self.run_script(
+            "create table t (x int);",
+            "insert into t values " + ", ".join(f"({i})" for i in range(100)) + ";",
+            "analyze t;",
+            "explain select * from t where x > 500;",
+            "insert into t values " + ", ".join(f"({i})" for i in range(1000, 1100)) + ";",
+            "explain select * from t where x > 500;",
+        )
+        estimates = [line for line in output if line.startswith("-> Filter")]
+        self.assertEqual(estimates[0], "-> Filter (x > 500) (estimated rows=0)")
+        self.assertNotEqual(estimates[1], "-> Filter (x > 500) (estimated rows=0)")
+
+if __name__ == '__main__':
+    unittest.main()